@@ -29,13 +29,16 @@ import random
 import time
 import zipfile
 import io
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
 import boto3
 from controller import SmartAPI
+from config import METAKG_URL_CACHE_DIR
 from filelock import FileLock, Timeout
 from model import ConsolidatedMetaKGDoc, MetaKGDoc
 from utils import indices
+from utils.metakg.graph import graph_store
 
 logging.basicConfig(level="INFO")
 
@@ -230,29 +233,147 @@ def resave():
         smartapi.save()
 
 
-def refresh_metakg(reset=True, include_trapi=True):
+def refresh_metakg(reset=True, include_trapi=True, cache_dir=METAKG_URL_CACHE_DIR, incremental=False, keep=2, bulk_options=None):
+    """Refresh the MetaKG index from all Translator APIs.
+    Unchanged TRAPI metakg responses are reused from cache_dir, by default METAKG_URL_CACHE_DIR
+    of config.py, set it to None to disable the cache.
+
+    With reset=True, edges are indexed into a new generation of the index, and the
+    MetaKG alias is switched to it once complete. keep previous generations are kept
+    for indices.rollback(MetaKGDoc). A build that fails, or with items that failed
+    to index, is deleted and the alias is left as is.
+    With reset=False, edges are added to the live index.
+    With incremental=True, only the edges of the APIs changed since the last refresh
+    are re-indexed in the live index, reset is then ignored. If the live index has no
+    API hashes recorded, e.g. it was built before they were, it is rebuilt in full instead.
+    bulk_options tune the bulk indexing, see utils.indices.bulk_index.
+    """
     es_logger = logging.getLogger("elasticsearch")
     es_logger.setLevel("WARNING")
 
-    if reset:
-        logging.info("Reset MetaKG index")
-        indices.reset(MetaKGDoc)
+    if incremental and not (indices.exists(MetaKGDoc) and "api_hashes" in indices.get_meta(MetaKGDoc)):
+        logging.warning("No API hashes recorded in the MetaKG index, rebuilding it in full")
+        incremental, reset = False, True
 
-    logging.info("Refreshing MetaKG index")
-    SmartAPI.refresh_metakg(include_trapi=include_trapi)
+    if incremental:
+        logging.info("Refreshing MetaKG index incrementally")
+        stats = SmartAPI.refresh_metakg(
+            include_trapi=include_trapi, cache_dir=cache_dir, incremental=True, bulk_options=bulk_options
+        )
+        _check_bulk_stats(stats, raise_error=False)
+    elif reset:
+        with _new_generations(MetaKGDoc) as (index,):
+            logging.info("Building MetaKG index %s", index)
+            stats = SmartAPI.refresh_metakg(
+                include_trapi=include_trapi, cache_dir=cache_dir, index=index, bulk_options=bulk_options
+            )
+            _check_bulk_stats(stats)
+            indices.refresh(MetaKGDoc, index=index)
+        logging.info("Switching MetaKG alias to %s", index)
+        if indices.switch_alias(MetaKGDoc, index, keep=keep):
+            SmartAPI.prune_metakg_operations(bulk_options=bulk_options)
+    else:
+        logging.info("Refreshing MetaKG index")
+        stats = SmartAPI.refresh_metakg(include_trapi=include_trapi, cache_dir=cache_dir, bulk_options=bulk_options)
+        _check_bulk_stats(stats, raise_error=False)
 
 
-def consolidate_metakg(reset=True):
+def consolidate_metakg(reset=True, keep=2, bulk_options=None):
     """Consolidate the MetaKG edge data into documents based on a subject-predicate-object key.
     Creates an index with the groups.
     *** Currently, must be run after running refresh_metakg()
+
+    With reset=True, the groups are indexed into a new generation of the index, and the
+    ConsolidatedMetaKG alias is switched to it once complete, like refresh_metakg.
     """
-    if reset:
-        logging.info("Reset ConsolidatedMetaKG index")
-        indices.reset(ConsolidatedMetaKGDoc)
+    if not reset:
+        logging.info("Consolidating/Refreshing MetaKG edges")
+        stats = SmartAPI.index_metakg_consolidation(bulk_options=bulk_options)
+        _check_bulk_stats({ConsolidatedMetaKGDoc.Index.name: stats}, raise_error=False)
+        _publish_consolidated_metakg()
+        return
+
+    with _new_generations(ConsolidatedMetaKGDoc) as (index,):
+        logging.info("Building ConsolidatedMetaKG index %s", index)
+        logging.info("Consolidating/Refreshing MetaKG edges")
+        stats = SmartAPI.index_metakg_consolidation(index=index, bulk_options=bulk_options)
+        _check_bulk_stats({index: stats})
+    if _publish_consolidated_metakg(index, keep=keep):
+        SmartAPI.prune_metakg_operations(bulk_options=bulk_options)
+
+
+def refresh_and_consolidate_metakg(include_trapi=True, cache_dir=METAKG_URL_CACHE_DIR, keep=2, bulk_options=None):
+    """Build new generations of both the MetaKG and the ConsolidatedMetaKG indices
+    in a single pass over the Translator APIs, then switch both aliases to them.
+    Equivalent to refresh_metakg() followed by consolidate_metakg(), without reading
+    the MetaKG index back.
+    """
+    es_logger = logging.getLogger("elasticsearch")
+    es_logger.setLevel("WARNING")
+
+    with _new_generations(MetaKGDoc, ConsolidatedMetaKGDoc) as (index, consolidated_index):
+        logging.info("Building MetaKG index %s and ConsolidatedMetaKG index %s", index, consolidated_index)
+        stats = SmartAPI.refresh_metakg(
+            include_trapi=include_trapi,
+            cache_dir=cache_dir,
+            index=index,
+            consolidated_index=consolidated_index,
+            bulk_options=bulk_options,
+        )
+        _check_bulk_stats(stats)
+        indices.refresh(MetaKGDoc, index=index)
+    logging.info("Switching MetaKG alias to %s", index)
+    deleted = indices.switch_alias(MetaKGDoc, index, keep=keep)
+    deleted += _publish_consolidated_metakg(consolidated_index, keep=keep)
+    if deleted:
+        SmartAPI.prune_metakg_operations(bulk_options=bulk_options)
+
+
+@contextmanager
+def _new_generations(*model_classes):
+    """Create a new generation of the index of each model class. If the build
+    fails, the new generations are deleted, so that no partial build is left
+    behind for indices.switch_alias or indices.rollback to pick up.
+    """
+    generations = []
+    try:
+        for model_class in model_classes:
+            generations.append(indices.create_generation(model_class))
+        yield generations
+    except BaseException:
+        for model_class, index in zip(model_classes, generations):
+            logging.error("MetaKG build failed, deleting index %s", index)
+            try:
+                indices.delete_generation(model_class, index)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to delete index %s", index)
+        raise
+
+
+def _check_bulk_stats(stats, raise_error=True):
+    """Report the indices of the bulk indexing stats with failed items.
+    With raise_error, raise an error so that the build is not published.
+    """
+    failed = {index: _stats["failed"] for index, _stats in stats.items() if _stats.get("failed")}
+    if not failed:
+        return
+    message = f"Failed to index items into {', '.join(f'{index} ({count})' for index, count in failed.items())}"
+    if raise_error:
+        raise RuntimeError(message)
+    logging.error(message)
+
 
-    logging.info("Consolidating/Refreshing MetaKG edges")
-    SmartAPI.index_metakg_consolidation()
+def _publish_consolidated_metakg(index=None, keep=None):
+    # stamp a new build version, so that path finder graphs
+    # cached by the web processes are rebuilt on next use
+    indices.refresh(ConsolidatedMetaKGDoc, index=index)
+    indices.update_meta(ConsolidatedMetaKGDoc, index=index, build_version=datetime.now(timezone.utc).isoformat())
+    deleted = []
+    if index:
+        logging.info("Switching ConsolidatedMetaKG alias to %s", index)
+        deleted = indices.switch_alias(ConsolidatedMetaKGDoc, index, keep=keep)
+    graph_store.reload()
+    return deleted
 
 
 def refresh_has_metakg():
@@ -327,10 +448,8 @@ def routine(no_backup=False, format="zip"):
             refresh_document()
             logger.info("check_uptime()")
             check_uptime()
-            logger.info("refresh_metakg()")
-            refresh_metakg()
-            logger.info("consolidate_metakg()")
-            consolidate_metakg()
+            logger.info("refresh_and_consolidate_metakg()")
+            refresh_and_consolidate_metakg()
             logger.info("refresh_has_metakg()")
             refresh_has_metakg()
         else:
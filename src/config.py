@@ -1,3 +1,4 @@
+import os
 from copy import deepcopy
 
 from biothings.web.auth.authn import DefaultCookieAuthnProvider
@@ -77,6 +78,36 @@ ES_INDICES = {
     "metakg": METAKG_ES_INDEX,
     "metakg_consolidated": METAKG_ES_INDEX_CONSOLIDATED,
 }
+# BTE operation payloads of the MetaKG edges, stored once by content hash and
+# referenced from the edges by api.bte_ref. Not a biothing type, not queried directly.
+METAKG_OPERATIONS_ES_INDEX = "smartapi_metakg_operations"
+# TRAPI /meta_knowledge_graph responses are cached on disk between MetaKG refreshes,
+# and fetched again with conditional requests. The routine MetaKG refresh runs in
+# the web process, so this must not be a path relative to its working directory.
+METAKG_URL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "smartapi", "metakg")
+
+# *****************************************************************************
+# MetaKG Path Finder
+# *****************************************************************************
+# /api/metakg/paths builds and traverses the MetaKG graph in a thread pool,
+# off the Tornado IOLoop. At most this many path queries run concurrently,
+# the others wait for a free worker.
+METAKG_PATHFINDER_WORKERS = 4
+# Finished path results are cached in memory, keyed on the normalized query,
+# up to this total number of edges. The cache is cleared when the consolidated
+# MetaKG is rebuilt. Set to 0 to disable it.
+METAKG_PATHFINDER_CACHE_EDGES = 100000
+
+# *****************************************************************************
+# MetaKG Parser
+# *****************************************************************************
+# /api/metakg/parse and /api/metakg/parse/batch parse documents in a thread pool,
+# off the Tornado IOLoop, with at most this many documents parsed concurrently.
+METAKG_PARSER_WORKERS = 4
+# A batch request parses at most this many urls and documents, and downloads
+# at most METAKG_PARSE_BATCH_CONCURRENCY of them at once.
+METAKG_PARSE_BATCH_MAX_ITEMS = 100
+METAKG_PARSE_BATCH_CONCURRENCY = 8
 
 # *****************************************************************************
 # Tornado URL Patterns
@@ -89,13 +120,14 @@ APP_LIST = [
     (r"/api/metadata/(.+)/?", "handlers.api.SmartAPIHandler"),
     (r"/api/fields/?", "biothings.web.handlers.MetadataFieldHandler", {"biothing_type": "metadata"}),
     (r"/api/build/?", "biothings.web.handlers.MetadataSourceHandler", {"biothing_type": "metadata"}),
-    (r"/api/status/?", "biothings.web.handlers.StatusHandler"),
+    (r"/api/status/?", "handlers.api.MetaKGStatusHandler"),
     (r"/api/suggestion/?", "handlers.api.ValueSuggestionHandler"),
     (r"/api/metakg/?", "handlers.api.MetaKGQueryHandler", {"biothing_type": "metakg"}),
     (r"/api/metakg/fields/?", "biothings.web.handlers.MetadataFieldHandler", {"biothing_type": "metakg"}),
     (r"/api/metakg/consolidated/?", "handlers.api.MetaKGQueryHandler", {"biothing_type": "metakg_consolidated"}),
     (r"/api/metakg/consolidated/fields/?", "biothings.web.handlers.MetadataFieldHandler", {"biothing_type": "metakg_consolidated"}),
     (r"/api/metakg/paths/?", "handlers.api.MetaKGPathFinderHandler", {"biothing_type": "metakgpathfinder"}),
+    (r"/api/metakg/parse/batch/?", "handlers.api.MetaKGBatchParserHandler"),
     (r"/api/metakg/parse/?", "handlers.api.MetaKGParserHandler"),
 ]
 
@@ -209,11 +209,12 @@ class AbstractWebEntity(ABC):
                 yield doc
 
     @classmethod
-    def get_all_via_scan(cls, size=1000, query_data=None, index=None, scroll="1m"):
+    def get_all_via_scan(cls, size=1000, query_data=None, index=None, scroll="1m", preserve_order=False):
         """Uses elasticsearch_dsl to traverse through the MetaKG index.
         Elasticsearch has a size window limit of 10,000.
         Using scan allows us to scroll through the data, and retrieve all index data hits.
         If no index name is passed, will set index to the default cls index name, `smartapi_docs`
+        Set preserve_order to keep the "sort" order of query_data, which makes the scroll slower.
         """
         from elasticsearch.helpers import scan
         from elasticsearch_dsl import connections
@@ -224,7 +225,7 @@ class AbstractWebEntity(ABC):
             index = cls.MODEL_CLASS.Index.name
 
         # Make the initial scan request
-        response = scan(es, query=query_data, index=index, size=size, scroll=scroll)
+        response = scan(es, query=query_data, index=index, size=size, scroll=scroll, preserve_order=preserve_order)
 
         for hit in response:
             yield hit
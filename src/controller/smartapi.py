@@ -34,22 +34,59 @@
         smartapi.delete()
 
 """
+import hashlib
+import json
 import logging
 import string
 from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
+from itertools import islice
+from queue import Full, Queue
+from threading import Event
 from warnings import warn
 
-from model import ConsolidatedMetaKGDoc, MetaKGDoc, SmartAPIDoc
-from utils import decoder, monitor
+from model import ConsolidatedMetaKGDoc, MetaKGDoc, MetaKGOperationDoc, SmartAPIDoc
+from utils import decoder, indices, monitor
 from utils.downloader import download
+from utils.metakg.bte import dehydrate_edge
+from utils.metakg.consolidation import EdgeConsolidator
 from utils.metakg.parser import MetaKGParser
+from utils.metakg.url_cache import MetaKGURLCache
 
 from .base import AbstractWebEntity, APIMonitorStatus, APIRefreshStatus, OpenAPI, Swagger
 from .exceptions import ConflictError, ControllerError
 
 logger = logging.getLogger(__name__)
 
+_FETCH_DONE = object()  # put in the edge queue by a fetch_all_metakg worker when done
+
+
+class _MetaKGHash:
+    """
+    Hash of the raw document and metakg edges of an API, updated one edge at a time.
+    Equal to sha256(sha256(raw).hexdigest() + json.dumps(edges, sort_keys=True, default=str)).
+    """
+
+    def __init__(self, raw):
+        raw = raw if isinstance(raw, bytes) else str(raw).encode()
+        self.raw_hash = hashlib.sha256(raw).hexdigest()
+        self.metakg_hash = None
+
+    def update(self, edge):
+        if self.metakg_hash is None:
+            self.metakg_hash = hashlib.sha256((self.raw_hash + "[").encode())
+        else:
+            self.metakg_hash.update(b", ")
+        self.metakg_hash.update(json.dumps(edge, sort_keys=True, default=str).encode())
+
+    def hexdigest(self):
+        if self.metakg_hash is None:
+            return hashlib.sha256((self.raw_hash + "[]").encode()).hexdigest()
+        metakg_hash = self.metakg_hash.copy()
+        metakg_hash.update(b"]")
+        return metakg_hash.hexdigest()
+
 # TODO etag support
 
 
@@ -146,86 +183,334 @@ class SmartAPI(AbstractWebEntity, Mapping):
         return super().find(val, field=field)
 
     @classmethod
-    def fetch_all_metakg(cls, include_trapi=True, report_errors=True):
+    def fetch_all_metakg(
+        cls, include_trapi=True, report_errors=True, max_workers=8, url_cache=None, api_hashes=None, queue_size=10000
+    ):
         """Fetch metakg edges from all Translator APIs, and return as
-        a generator of edges.
+        a generator of edges, as utils.metakg.edge.MetaKGEdge records.
+
+        APIs are fetched concurrently in a pool of max_workers threads,
+        requests to the same TRAPI server are limited by
+        MetaKGParser.max_requests_per_host. Edges are streamed from the
+        TRAPI responses as they are parsed, through a queue of at most
+        queue_size edges, so no API metakg is held in memory at once.
+        With a url_cache, unchanged TRAPI metakgs are reused instead of
+        downloaded again. If api_hashes is a dict, it is filled with the
+        hash of each API, as returned by fetch_metakg_by_api.
         """
         count_docs = cls.count()
         query_data = {"type": "term", "body": {"tags.name": "translator"}}
         all_apis = cls.get_all(size=count_docs, query_data=query_data)
+        edges = Queue(maxsize=queue_size)
+        stop = Event()
         metakg_error_list = []
-        for api in all_apis:
+
+        def _put(item):
+            # give up once the consumer is gone, instead of blocking on a full queue
+            while not stop.is_set():
+                try:
+                    edges.put(item, timeout=1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def _fetch_metakg(api):
+            try:
+                logger.info("[%s]", api._doc.info.title)
+                logger.info("SmartAPI ID: %s", api._id)
+                api_hash = _MetaKGHash(api.raw)
+                fetch_trapi = api.is_trapi and include_trapi
+                count = 0
+                for edge in api.iter_metakg(include_trapi=include_trapi, url_cache=url_cache):
+                    if fetch_trapi:
+                        api_hash.update(edge.to_dict())
+                    if not _put(edge):
+                        return
+                    count += 1
+                cls._collect_metakg_errors(api, metakg_error_list)
+                if api_hashes is not None and not (fetch_trapi and api.metakg_errors and not count):
+                    api_hashes[api._id] = api_hash.hexdigest() if fetch_trapi else api_hash.raw_hash
+            except Exception as err:
+                _put(err)
+            finally:
+                _put(_FETCH_DONE)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch_metakg")
+        futures = []
+        try:
+            futures.extend(executor.submit(_fetch_metakg, api) for api in all_apis)
+            remaining = len(futures)
+            while remaining:
+                item = edges.get()
+                if item is _FETCH_DONE:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item  # each item is a metakg edge
+        finally:
+            stop.set()
+            # cancel the fetches not started yet, as shutdown(cancel_futures=True) of python 3.9+
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+        if report_errors:
+            cls._report_metakg_errors(metakg_error_list)
+
+    @classmethod
+    def fetch_metakg_by_api(cls, include_trapi=True, report_errors=True, max_workers=8, url_cache=None, api_hashes=None):
+        """Fetch the metakg edges of all Translator APIs, and return as
+        a generator of (api_id, api_hash, edges) tuples, in completion order.
+        edges is a list of utils.metakg.edge.MetaKGEdge records.
+
+        api_hash identifies the content an API's edges are built from, i.e.
+        its raw document and for a TRAPI its metakg edges. If it equals the
+        hash of api_hashes, a dict of api_id to the hashes of a previous
+        fetch, edges is None as they did not change. It is also None when a
+        TRAPI metakg could not be retrieved, or is not fetched as include_trapi
+        is False, the previous hash is then kept.
+        """
+        count_docs = cls.count()
+        query_data = {"type": "term", "body": {"tags.name": "translator"}}
+        all_apis = iter(cls.get_all(size=count_docs, query_data=query_data))
+        api_hashes = api_hashes or {}
+        metakg_error_list = []
+
+        def _get_metakg(api):
             logger.info("[%s]", api._doc.info.title)
             logger.info("SmartAPI ID: %s", api._id)
-            metakg = api.get_metakg(include_trapi=include_trapi)
-            if api.metakg_errors:
-                api.metakg_errors.setdefault("_id", api._id)
-                api.metakg_errors.setdefault("title", api._doc.info.title)
-                api.metakg_errors.setdefault("url", "http://smart-api.info/registry?q=" + api._id)
-                metakg_error_list.append(api.metakg_errors)
-            yield from metakg  # each item is a metakg edge
-        if report_errors and metakg_error_list:
+            if api.is_trapi and not include_trapi:
+                # its edges all come from its TRAPI metakg, keep the previous ones
+                return api, api_hashes.get(api._id), None
+            raw = api.raw if isinstance(api.raw, bytes) else str(api.raw).encode()
+            api_hash = hashlib.sha256(raw).hexdigest()
+            fetch_trapi = api.is_trapi and include_trapi
+            if not fetch_trapi and api_hashes.get(api._id) == api_hash:
+                return api, api_hash, None
+            metakg = list(api.iter_metakg(include_trapi=include_trapi, url_cache=url_cache))
+            if fetch_trapi:
+                # a metakg stream can fail midway, keep the previous edges rather than partial ones
+                if api.metakg_errors and (not metakg or api._id in api_hashes):
+                    return api, api_hashes.get(api._id), None
+                metakg_hash = _MetaKGHash(raw)
+                for edge in metakg:
+                    metakg_hash.update(edge.to_dict())
+                api_hash = metakg_hash.hexdigest()
+                if api_hashes.get(api._id) == api_hash:
+                    return api, api_hash, None
+            return api, api_hash, metakg
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch_metakg") as executor:
+            # keep a bounded number of APIs in flight, so that finished
+            # edges do not pile up in memory faster than they are consumed
+            pending = {executor.submit(_get_metakg, api) for api in islice(all_apis, max_workers * 2)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    api, api_hash, metakg = future.result()
+                    cls._collect_metakg_errors(api, metakg_error_list)
+                    pending.update(executor.submit(_get_metakg, api) for api in islice(all_apis, 1))
+                    yield api._id, api_hash, metakg
+        if report_errors:
+            cls._report_metakg_errors(metakg_error_list)
+
+    @staticmethod
+    def _collect_metakg_errors(api, metakg_error_list):
+        if api.metakg_errors:
+            api.metakg_errors.setdefault("_id", api._id)
+            api.metakg_errors.setdefault("title", api._doc.info.title)
+            api.metakg_errors.setdefault("url", "http://smart-api.info/registry?q=" + api._id)
+            metakg_error_list.append(api.metakg_errors)
+
+    @staticmethod
+    def _report_metakg_errors(metakg_error_list):
+        if metakg_error_list:
             logger.error("=" * 50)
             logger.error("Found errors in %s APIs during metakg retrieval:", len(metakg_error_list))
             for error in metakg_error_list:
                 logger.error(error)
 
     @classmethod
-    def refresh_metakg(cls, include_trapi=True):
-        """Fetch all metakg edges and saved to the ES index in bulk"""
-        from elasticsearch.helpers import bulk
+    def refresh_metakg(
+        cls, include_trapi=True, cache_dir=None, incremental=False, index=None, consolidated_index=None, bulk_options=None
+    ):
+        """Fetch all metakg edges and saved to the ES index in bulk.
+        TRAPI metakg responses are cached in cache_dir if provided.
+        Edges are saved to the MetaKG index, or to the given index, e.g. a new generation.
+
+        If consolidated_index is provided, the edges are also consolidated while they
+        are indexed, and the groups are saved to consolidated_index once all edges are
+        fetched, in a single pass instead of scanning the MetaKG index afterwards.
+        The groups are held in memory until then.
+
+        The hash of each API is recorded in the index "_meta". In incremental
+        mode, only the APIs whose hash changed since are re-indexed: their
+        previous edges are deleted by query on api.smartapi.id before their
+        new edges are inserted, and the edges of removed APIs are deleted.
+        An index without recorded hashes, e.g. built before they were, cannot
+        be refreshed incrementally, a ValueError is raised.
+
+        The BTE operation payload of each edge is replaced by its hash, and stored
+        once in the MetaKGOperation index, see utils.metakg.bte.
+
+        bulk_options are passed to utils.indices.bulk_index, e.g. thread_count or chunk_size.
+        Return the indexing stats of each index.
+        """
         from elasticsearch_dsl import connections
 
-        es = connections.get_connection()
-        edge_iterable = (
-            MetaKGDoc(**edge).to_dict(include_meta=True) for edge in cls.fetch_all_metakg(include_trapi=include_trapi)
-        )
-        bulk(es, edge_iterable)
+        if incremental and consolidated_index:
+            raise ValueError("An incremental refresh cannot build the consolidated index.")
 
-    @classmethod
-    def edge_consolidation_build(cls):
-        """Traverse through the MetaKG index and aggregate edges into groups based on their subject/predicate/object"""
-        edge_dict = {}
-        processed_edges = 0
-        # loop through MetaKG index with ES scan method
-        for edge in cls.get_all_via_scan(size=10000, index=MetaKGDoc.Index.name):
-            # Set key which we group by: subject-predicate-object
-            key = f'{edge["_source"]["subject"]}-{edge["_source"]["predicate"]}-{edge["_source"]["object"]}'
-            # Set edge details
-            edge_api = edge["_source"]["api"]
-
-            # Add edge to the dictionary, merging API details if the edge already exists
-            if key in edge_dict:
-                if edge_api not in edge_dict[key]["api"]:
-                    edge_dict[key]["api"].append(edge_api)
-            else:
-                edge_dict[key] = {
-                    "_id": key,
-                    "subject": edge["_source"]["subject"],
-                    "object": edge["_source"]["object"],
-                    "predicate": edge["_source"]["predicate"],
-                    "api": [edge_api],
-                    **{k: edge["_source"][k] for k in ["subject_prefix", "object_prefix"] if k in edge["_source"]}
-                }
-
-            processed_edges += 1
-
-        for key in edge_dict:
-            yield edge_dict[key]
-
-        del edge_dict
+        es = connections.get_connection()
+        index = index or MetaKGDoc.Index.name
+        consolidator = EdgeConsolidator() if consolidated_index else None
+        indices.setup(MetaKGOperationDoc)
+        operations_index = MetaKGOperationDoc.Index.name
+        bte_refs = set()  # payloads already sent in this run
+        url_cache = MetaKGURLCache(cache_dir) if cache_dir else None
+        previous_hashes = {}
+        if incremental:
+            previous_hashes = indices.get_meta(MetaKGDoc, index=index).get("api_hashes")
+            if previous_hashes is None:
+                # every API would look new, and be indexed again next to its existing edges
+                raise ValueError(f"No API hashes recorded in {index}, it must be refreshed in full first.")
+        api_hashes = {}
+
+        def _delete_api_edges(api_id):
+            es.delete_by_query(
+                index=index,
+                query={"term": {"api.smartapi.id": api_id}},
+                conflicts="proceed",
+                refresh=True,
+            )
+
+        def _api_edges():
+            if not incremental:
+                # streamed from the responses to the bulk writer, one edge at a time
+                yield from cls.fetch_all_metakg(include_trapi=include_trapi, url_cache=url_cache, api_hashes=api_hashes)
+                return
+            apis = cls.fetch_metakg_by_api(include_trapi=include_trapi, url_cache=url_cache, api_hashes=previous_hashes)
+            for api_id, api_hash, metakg in apis:
+                if api_hash:
+                    api_hashes[api_id] = api_hash
+                if metakg is None:
+                    continue
+                if api_id in previous_hashes:
+                    logger.info("Re-indexing metakg edges of %s", api_id)
+                    _delete_api_edges(api_id)
+                yield from metakg
+
+        def _edge_iterable():
+            for edge in _api_edges():
+                operation = dehydrate_edge(edge)
+                if operation and operation[0] not in bte_refs:
+                    bte_refs.add(operation[0])
+                    yield {"_index": operations_index, "_id": operation[0], "_source": {"bte": operation[1]}}
+                doc = {**MetaKGDoc(**edge.to_dict()).to_dict(include_meta=True), "_index": index}
+                if consolidator is not None:
+                    consolidator.add(edge)
+                yield doc
+
+        bulk_options = bulk_options or {}
+        stats = {index: indices.bulk_index(_edge_iterable(), name="metakg", **bulk_options)}
+        if consolidator is not None:
+            logger.info("Indexing %s consolidated metakg edges", len(consolidator))
+            consolidated_iterable = (
+                {**ConsolidatedMetaKGDoc(**edge).to_dict(include_meta=True), "_index": consolidated_index}
+                for edge in consolidator.pop_groups()
+            )
+            stats[consolidated_index] = indices.bulk_index(consolidated_iterable, name="metakg_consolidated", **bulk_options)
+        for api_id in previous_hashes.keys() - api_hashes.keys():
+            logger.info("Deleting metakg edges of removed API %s", api_id)
+            _delete_api_edges(api_id)
+        indices.update_meta(MetaKGDoc, index=index, api_hashes=api_hashes)
+        return stats
 
     @classmethod
-    def index_metakg_consolidation(cls):
-        """Fetch all metakg edges in the ES index and consolidate edges(into another index)"""
-        from elasticsearch.helpers import bulk
+    def prune_metakg_operations(cls, bulk_options=None):
+        """Delete the BTE operation payloads no longer referenced by the edges of any
+        MetaKG or ConsolidatedMetaKG index, live or not, e.g. once old generations are deleted.
+        Should not run while a build is in progress, its edges are not all indexed yet.
+        Return the number of deleted payloads.
+        """
         from elasticsearch_dsl import connections
 
         es = connections.get_connection()
+        referenced = set()
+        for model_class in (MetaKGDoc, ConsolidatedMetaKGDoc):
+            name = model_class.Index.name
+            field_mappings = es.indices.get_field_mapping(
+                index=f"{name},{name}-*", fields="api.bte_ref", ignore_unavailable=True, allow_no_indices=True
+            )
+            for _index, _mapping in field_mappings.items():
+                field_type = _mapping["mappings"].get("api.bte_ref", {}).get("mapping", {}).get("bte_ref", {}).get("type")
+                if not field_type:
+                    continue
+                # before it was declared, api.bte_ref was mapped as a text field with a "raw" keyword
+                field = "api.bte_ref" if field_type == "keyword" else "api.bte_ref.raw"
+                referenced |= cls._iter_field_values(es, _index, field)
+
+        deleted = 0
+        operations_index = MetaKGOperationDoc.Index.name
+        if indices.exists(MetaKGOperationDoc):
+            unreferenced = (
+                {"_op_type": "delete", "_index": operations_index, "_id": hit["_id"]}
+                for hit in cls.get_all_via_scan(size=10000, query_data={"_source": False}, index=operations_index)
+                if hit["_id"] not in referenced
+            )
+            deleted = indices.bulk_index(unreferenced, name="metakg_operations", **(bulk_options or {}))["docs"]
+        logger.info("Deleted %s unreferenced BTE operation payloads, %s referenced", deleted, len(referenced))
+        return deleted
+
+    @staticmethod
+    def _iter_field_values(es, index, field, size=10000):
+        """Return the set of the values of a keyword field in the index, with a composite aggregation."""
+        values, after = set(), None
+        while True:
+            composite = {"size": size, "sources": [{"value": {"terms": {"field": field}}}]}
+            if after:
+                composite["after"] = after
+            response = es.search(index=index, size=0, aggs={"values": {"composite": composite}})
+            agg = response["aggregations"]["values"]
+            values.update(bucket["key"]["value"] for bucket in agg["buckets"])
+            after = agg.get("after_key")
+            if not after or not agg["buckets"]:
+                return values
+
+    @classmethod
+    def edge_consolidation_build(cls):
+        """Traverse through the MetaKG index and aggregate edges into groups based on their subject/predicate/object
+
+        The index is scanned sorted on subject/predicate/object, so that each group
+        is complete, and yielded, as soon as the sort key changes. Only the edges
+        sharing one sort key are held in memory. The APIs of a group are deduplicated
+        by a hash of their content.
+        """
+        query_data = {"sort": [{"subject.raw": "asc"}, {"predicate": "asc"}, {"object.raw": "asc"}]}
+        edges = cls.get_all_via_scan(size=10000, query_data=query_data, index=MetaKGDoc.Index.name, preserve_order=True)
+        # predicate is a lowercase normalized keyword, so one sort key
+        # can span several groups differing only by the predicate case
+        sort_key, consolidator = None, EdgeConsolidator()
+        for edge in edges:
+            if tuple(edge.get("sort", ())) != sort_key:
+                yield from consolidator.pop_groups()
+                sort_key = tuple(edge.get("sort", ()))
+            consolidator.add(edge["_source"])
+        yield from consolidator.pop_groups()
+
+    @classmethod
+    def index_metakg_consolidation(cls, index=None, bulk_options=None):
+        """Fetch all metakg edges in the ES index and consolidate edges(into another index).
+        Edges are saved to the ConsolidatedMetaKG index, or to the given index, e.g. a new generation.
+        bulk_options are passed to utils.indices.bulk_index, return its indexing stats.
+        """
+        index = index or ConsolidatedMetaKGDoc.Index.name
         edge_iterable = (
-            ConsolidatedMetaKGDoc(**edge).to_dict(include_meta=True) for edge in cls.edge_consolidation_build()
+            {**ConsolidatedMetaKGDoc(**edge).to_dict(include_meta=True), "_index": index}
+            for edge in cls.edge_consolidation_build()
         )
-        bulk(es, edge_iterable)
+        return indices.bulk_index(edge_iterable, name="metakg_consolidated", **(bulk_options or {}))
 
     # Instance methods below which is specific to a given SmartAPI entity
     @property
@@ -369,16 +654,22 @@ class SmartAPI(AbstractWebEntity, Mapping):
         """return True if a TRAPI"""
         return self.has_tags("trapi", "translator")
 
-    def get_metakg(self, include_trapi=True):
+    def get_metakg(self, include_trapi=True, url_cache=None):
+        return [edge.to_dict() for edge in self.iter_metakg(include_trapi=include_trapi, url_cache=url_cache)]
+
+    def iter_metakg(self, include_trapi=True, url_cache=None):
+        """Yield the metakg edges as MetaKGEdge records, streamed from the TRAPI responses.
+        self.metakg_errors is set once the generator is exhausted."""
         raw_metadata = decoder.to_dict(decoder.decompress(self._doc._raw))
         mkg_parser = MetaKGParser()
+        mkg_parser.url_cache = url_cache
         extra_data = {"id": self._id, "url": self.url}
         self.metakg_errors = None  # reset metakg_errors
         if self.is_trapi:
-            metakg = mkg_parser.get_TRAPI_metadatas(raw_metadata, extra_data) if include_trapi else []
+            if include_trapi:
+                yield from mkg_parser.iter_TRAPI_metadatas(raw_metadata, extra_data)
         else:
-            metakg = mkg_parser.get_non_TRAPI_metadatas(raw_metadata, extra_data)
+            yield from mkg_parser.iter_non_TRAPI_metadatas(raw_metadata, extra_data)
         if mkg_parser.metakg_errors:
             # hold metakg_errors for later use
             self.metakg_errors = mkg_parser.metakg_errors
-        return metakg
@@ -2,14 +2,19 @@ import asyncio
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 
 import bmt
 from biothings.utils import serializer
 from biothings.web.auth.authn import BioThingsAuthnMixin
-from biothings.web.handlers import BaseAPIHandler, QueryHandler
+from biothings.web.handlers import BaseAPIHandler, QueryHandler, StatusHandler
 from biothings.web.handlers.query import BiothingHandler, capture_exceptions
 from biothings.web.settings.default import QUERY_KWARGS
 from tornado.httpclient import AsyncHTTPClient
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
 from tornado.template import Loader
 from tornado.web import Finish, HTTPError
 
@@ -21,8 +26,9 @@ from utils.http_error import SmartAPIHTTPError
 from utils.metakg.biolink_helpers import get_expanded_values
 from utils.metakg.cytoscape_formatter import CytoscapeDataFormatter
 from utils.metakg.export import edges2graphml
+from utils.metakg.graph import graph_store
 from utils.metakg.parser import MetaKGParser
-from utils.metakg.path_finder import MetaKGPathFinder
+from utils.metakg.path_finder import MetaKGPathFinder, PathResultCache
 from utils.notification import SlackNewAPIMessage, SlackNewTranslatorAPIMessage
 
 logger = logging.getLogger("smartAPI")
@@ -417,6 +423,7 @@ class MetaKGHandlerMixin:
         elif api_details:
             # When api_details is True, include more detailed information
             filtered_api = api_info.copy()
+            filtered_api.pop("bte_ref", None)  # hydrated into "bte" if requested
             if not bte:
                 filtered_api.pop("bte", None)
 
@@ -608,8 +615,23 @@ class MetaKGPathFinderHandler(QueryHandler):
 
     The primary GET method accepts the required 'subject', 'object', and 'cutoff'(default=3) parameters, then retrieves
     and returns paths in JSON format between the specified nodes up to the given 'cutoff' length.
+    With &format=ndjson, each path is written and flushed as a single JSON line as soon as it is found,
+    followed by a last line with the "total" and "truncated" summary.
+    Results can be paginated with 'size' and 'from'. Enumeration stops once the page is filled or 'max_paths'
+    paths are found, and "truncated" is then true in the response.
+
+    Graph building and path enumeration run in a thread pool of METAKG_PATHFINDER_WORKERS threads,
+    so that path queries do not block the IOLoop.
+
+    JSON results on the shared graph are cached in an LRU cache of METAKG_PATHFINDER_CACHE_EDGES edges,
+    the X-Cache header tells if a response was a HIT or a MISS, X-Cache-Hits and X-Cache-Misses
+    report the counters of this process, also listed by /api/status?dev.
     """
 
+    executor = None  # shared by all requests, created on first use
+    cache = None  # shared by all requests, created on first use
+    stream_batch_size = 100  # paths enumerated per executor call in ndjson mode
+
     name = "metakgpathfinder"
     kwargs = {
         "GET": {
@@ -618,6 +640,10 @@ class MetaKGPathFinderHandler(QueryHandler):
             "object": {"type": str, "required": True, "max": 1000},
             "predicate": {"type": list, "max": 10, "default": []},
             "cutoff": {"type": int, "default": 3, "max": 5},
+            "size": {"type": int, "default": None, "max": 10000, "alias": "limit"},
+            "from": {"type": int, "default": 0, "max": 10000, "alias": "skip"},
+            # upper bound of paths enumerated for a single query, whatever size and from
+            "max_paths": {"type": int, "default": 10000, "max": 10000},
             "api_details": {"type": bool, "default": False},
             "rawquery": {"type": bool, "default": False},
             "bte": {"type": bool, "default": False},
@@ -626,7 +652,13 @@ class MetaKGPathFinderHandler(QueryHandler):
                 "max": 6,
                 "default": [],
                 "enum": ["subject", "object", "predicate", "node", "edge", "all"]
-            }
+            },
+            # add "ndjson" option to stream one path per line as they are found
+            "format": {
+                "type": str,
+                "default": "json",
+                "enum": ("json", "yaml", "html", "msgpack", "ndjson"),
+            },
         },
     }
 
@@ -636,6 +668,52 @@ class MetaKGPathFinderHandler(QueryHandler):
         self.pipeline = MetaKGQueryPipeline(ns=self.biothings)
         self.biolink_model_toolkit = bmt.Toolkit()
 
+    def get_executor(self):
+        cls = type(self)
+        if cls.executor is None:
+            max_workers = getattr(self.biothings.config, "METAKG_PATHFINDER_WORKERS", 4)
+            cls.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="metakg_pathfinder")
+        return cls.executor
+
+    def get_cache(self):
+        cls = type(self)
+        if cls.cache is None:
+            max_edges = getattr(self.biothings.config, "METAKG_PATHFINDER_CACHE_EDGES", 100000)
+            cls.cache = PathResultCache(max_edges=max_edges)
+        return cls.cache
+
+    def get_cache_key(self):
+        return PathResultCache.make_key(
+            self.args.subject,
+            self.args.object,
+            self.args.cutoff,
+            predicates=self.args.predicate,
+            expand=self.args.expand,
+            api_details=self.args.api_details,
+            bte=self.args.bte,
+            size=self.args.size,
+            from_=self.args["from"],
+            max_paths=self.args.max_paths,
+        )
+
+    def set_cache_headers(self, cache, status):
+        stats = cache.stats()
+        self.set_header("X-Cache", status)
+        self.set_header("X-Cache-Hits", stats["hits"])
+        self.set_header("X-Cache-Misses", stats["misses"])
+
+    async def run_in_executor(self, func, *args):
+        """Run a blocking or CPU-bound call in the path finder thread pool."""
+        return await IOLoop.current().run_in_executor(self.get_executor(), func, *args)
+
+    def get_pathfinder(self, expanded_fields):
+        """Initialize the pathfinder, this blocks if the graph needs to be built."""
+        if self.args.q:
+            # a filtered graph is specific to this query, build it from the index
+            return MetaKGPathFinder(query_data={"q": self.args.q}, expanded_fields=expanded_fields)
+        # the full graph is built once and shared by all requests in this process
+        return MetaKGPathFinder(expanded_fields=expanded_fields, graph=graph_store.get())
+
     def setup_pathfinder_rawquery(self, expanded_fields):
         # JSON-structured summary of operations and criteria applied
         operations_summary = {
@@ -677,7 +755,18 @@ class MetaKGPathFinderHandler(QueryHandler):
         if self.args.subject == self.args.object:
             raise ValueError("Subject and object must be different.")
 
-        query_data = {"q": self.args.q}
+        # only full JSON results on the shared graph are cached
+        cache = self.get_cache()
+        if self.args.q or self.args.rawquery or self.format == "ndjson" or cache.max_edges <= 0:
+            cache = None
+        else:
+            cache_key = self.get_cache_key()
+            graph = await self.run_in_executor(graph_store.get)
+            res = cache.get(graph, cache_key)
+            if res is not None:
+                self.set_cache_headers(cache, "HIT")
+                self.finish(res)
+                return
 
         # Initialize with the original subject and object, and setup for expansion
         expanded_fields = {
@@ -706,19 +795,23 @@ class MetaKGPathFinderHandler(QueryHandler):
                 expanded_fields[field] = get_expanded_values(getattr(self.args, field), self.biolink_model_toolkit)
 
         # Initalize pathfinder
-        pathfinder = MetaKGPathFinder(query_data=query_data, expanded_fields=expanded_fields)
+        pathfinder = await self.run_in_executor(self.get_pathfinder, expanded_fields)
 
-        # Initialize the pathfinder results list
-        paths_with_edges = []
+        if self.format == "ndjson" and not self.args.rawquery:
+            await self.stream_paths(pathfinder)
+            return
 
         # Run get_paths method to retrieve paths and edges
-        paths_with_edges = pathfinder.get_paths(
-            # expanded_fields=expanded_fields,
+        paths_with_edges = await self.run_in_executor(partial(
+            pathfinder.get_paths,
             cutoff=self.args.cutoff,
             api_details=self.args.api_details,
             predicate_filter=self.args.predicate,
-            bte=self.args.bte
-        )
+            bte=self.args.bte,
+            size=self.args.size,
+            from_=self.args["from"],
+            max_paths=self.args.max_paths,
+        ))
 
         # # Error check path results
         if "error" in paths_with_edges:
@@ -731,13 +824,124 @@ class MetaKGPathFinderHandler(QueryHandler):
             return
         res = {
             "total": len(paths_with_edges),
+            "truncated": pathfinder.truncated,
             "paths": paths_with_edges,
         }
+        if cache is not None:
+            weight = sum(len(path["edges"]) for path in paths_with_edges)
+            cache.set(pathfinder.graph, cache_key, res, weight)
+            self.set_cache_headers(cache, "MISS")
         await asyncio.sleep(0.01)
         self.finish(res)
 
+    async def stream_paths(self, pathfinder):
+        """
+        Write the paths as newline delimited JSON as they are found. Paths are
+        enumerated in the thread pool by batches of stream_batch_size, and each
+        batch is flushed before the next one, so memory use stays bounded.
+        """
+        error = pathfinder.find_missing_node()
+        if error:
+            raise HTTPError(400, reason=error)
 
-class MetaKGParserHandler(BaseHandler, MetaKGHandlerMixin):
+        self.set_header("Content-Type", "application/x-ndjson; charset=UTF-8")
+        paths = pathfinder.iter_paths(
+            cutoff=self.args.cutoff,
+            api_details=self.args.api_details,
+            predicate_filter=self.args.predicate,
+            bte=self.args.bte,
+            size=self.args.size,
+            from_=self.args["from"],
+            max_paths=self.args.max_paths,
+        )
+        total = 0
+        try:
+            while True:
+                batch = await self.run_in_executor(list, islice(paths, self.stream_batch_size))
+                if not batch:
+                    break
+                for path in batch:
+                    # bypass format handling of BaseAPIHandler.write
+                    super(BaseAPIHandler, self).write(serializer.to_json(path) + "\n")
+                await self.flush()
+                total += len(batch)
+        except StreamClosedError:
+            logger.info("Client closed the connection while streaming paths.")
+            return
+        except Exception as exc:
+            # the response status is already sent, report the error in the last line
+            logger.warning(exc)
+            super(BaseAPIHandler, self).write(serializer.to_json({"error": str(exc)}) + "\n")
+        else:
+            # the last line summarizes the results
+            super(BaseAPIHandler, self).write(serializer.to_json({"total": total, "truncated": pathfinder.truncated}) + "\n")
+        self.finish()
+
+
+class MetaKGStatusHandler(StatusHandler):
+    """
+    Web service health check
+
+    With ?dev, the counters of the MetaKG path result cache of this process are
+    reported under "metakg_pathfinder_cache", once a path query has created it.
+    """
+
+    async def _check(self, dev=False):
+        response = await super()._check(dev)
+        cache = MetaKGPathFinderHandler.cache
+        if dev and cache is not None:
+            response["metakg_pathfinder_cache"] = cache.stats()
+        return response
+
+
+class MetaKGParserMixin(MetaKGHandlerMixin):
+    """
+    Mixin to parse SmartAPI documents into filtered MetaKG edges, in a thread pool
+    of METAKG_PARSER_WORKERS threads shared by the parser handlers.
+    """
+
+    executor = None  # shared by all parser handlers, created on first use
+
+    def get_executor(self):
+        if MetaKGParserMixin.executor is None:
+            max_workers = getattr(self.biothings.config, "METAKG_PARSER_WORKERS", 4)
+            MetaKGParserMixin.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="metakg_parser")
+        return MetaKGParserMixin.executor
+
+    def get_body_data(self):
+        """
+        Return the JSON or YAML object of the request body, or None if there is no body.
+        A body without a proper content type is parsed as YAML anyway.
+        """
+        if self.args_json or self.args_yaml:
+            # if content type is set properly, it should have alrady been parsed
+            return self.args_json or self.args_yaml
+        if self.request.body:
+            return self._parse_yaml()
+        return None
+
+    async def parse_metakg(self, data=None, url=None):
+        """
+        Parse the MetaKG edges of a document, or of the document at url. Downloads do not block
+        the IOLoop, and the parsing runs in the parser thread pool.
+        """
+        parser = MetaKGParser()
+        return await parser.get_metakg_async(data, url=url, executor=self.get_executor())
+
+    def filter_metakg(self, parsed_metakg, url=None):
+        """Filter the parsed edges in place based on provided args, and return them."""
+        for i, api_dict in enumerate(parsed_metakg):
+            parsed_metakg[i] = self.get_filtered_api(api_dict)
+
+        # Add url to metadata if api_details is set to 1
+        if url and self.args.api_details:
+            for data_dict in parsed_metakg:
+                if "metadata" in data_dict["api"]["smartapi"] and data_dict["api"]["smartapi"]["metadata"] is None:
+                    data_dict["api"]["smartapi"]["metadata"] = url
+        return parsed_metakg
+
+
+class MetaKGParserHandler(BaseHandler, MetaKGParserMixin):
     """
         Handles parsing of SmartAPI metadata from a given URL or request body.
 
@@ -795,29 +999,21 @@ class MetaKGParserHandler(BaseHandler, MetaKGHandlerMixin):
 
     async def get(self, *args, **kwargs):
         url = self.args.url
-        parser = MetaKGParser()
 
         try:
-            parsed_metakg = parser.get_metakg(url=url)
-        except DownloadError:
-            self.write_error(400, reason="There was an error downloading the data from the given url.")
+            parsed_metakg = await self.parse_metakg(url=url)
+        except DownloadError as err:
+            raise HTTPError(400, reason="There was an error downloading the data from the given url.") from err
         except (ValueError, TypeError) as err:
-            self.write_error(
-                status_code=400,
+            raise HTTPError(
+                400,
+                None,
+                {"message": str(err)},
                 reason="The data retrived from the given url is not a valid JSON or YAML object.",
-                message=str(err)
-            )
+            ) from err
 
-        # Apply filtering -- if data found
-        if parsed_metakg:
-            for i, api_dict in enumerate(parsed_metakg):
-                parsed_metakg[i] = self.get_filtered_api(api_dict)
-
-        # Add url to metadata if api_details is set to 1
-        if self.args.api_details:
-            for data_dict in parsed_metakg:
-                if "metadata" in data_dict["api"]["smartapi"] and data_dict["api"]["smartapi"]["metadata"] is None:
-                    data_dict["api"]["smartapi"]["metadata"] = url
+        # Apply filtering, and add url to metadata if api_details is set to 1
+        parsed_metakg = self.filter_metakg(parsed_metakg, url=url)
 
         response = {
             "total": len(parsed_metakg),
@@ -827,26 +1023,14 @@ class MetaKGParserHandler(BaseHandler, MetaKGHandlerMixin):
         self.finish(response)
 
     async def post(self, *args, **kwargs):
-        content_type = self.request.headers.get("Content-Type", "").lower()
-        if content_type in ["application/json", "application/x-yaml"]:
-            # if content type is set properly, it should have alrady been parsed
-            metadata_from_body = self.args_json or self.args_yaml
-        elif self.request.body:
-            # if request body is provided but no proper content type is set
-            # we will parse it as YAML anyway
-            metadata_from_body = self._parse_yaml()
-        else:
-            metadata_from_body = None
+        metadata_from_body = self.get_body_data()
 
         if metadata_from_body:
             # Process the parsed metadata
-            parser = MetaKGParser()
-            parsed_metakg = parser.get_metakg(metadata_from_body)
+            parsed_metakg = await self.parse_metakg(data=metadata_from_body)
 
             # Apply filtering to the combined data
-            if parsed_metakg:
-                for i, api_dict in enumerate(parsed_metakg):
-                    parsed_metakg[i] = self.get_filtered_api(api_dict)
+            parsed_metakg = self.filter_metakg(parsed_metakg)
 
             # Send the response back to the client
             response = {
@@ -861,3 +1045,115 @@ class MetaKGParserHandler(BaseHandler, MetaKGHandlerMixin):
                 reason="Request body cannot be empty.",
                 message="Please provide a valid JSON/YAML object in the request body."
             )
+
+
+class MetaKGBatchParserHandler(BaseHandler, MetaKGParserMixin):
+    """
+        Parses the MetaKG edges of many SmartAPI documents in one request.
+
+        POST /api/metakg/parse/batch
+        {
+            "urls": ["<url of a SmartAPI document>", ...],
+            "documents": [{<SmartAPI document>}, ...]
+        }
+
+        Items are downloaded and parsed concurrently, at most METAKG_PARSE_BATCH_CONCURRENCY
+        at a time, and documents are parsed in the parser thread pool.
+        The response has one result per url, then per document, in the request order:
+        {"index": 0, "url": ..., "total": <number of edges>, "hits": [<edges>]}, or
+        {"index": 0, "url": ..., "error": {"code": 400, "reason": ..., "message": ...}}
+        if that item failed. With &format=ndjson, each result is written on its own line
+        as soon as it is ready, and a last line reports the "total" and "errors" counts.
+
+        Query Parameters: `api_details` and `bte`, as for /api/metakg/parse.
+    """
+
+    name = "metakgbatchparser"
+    kwargs = {
+        "*": MetaKGParserHandler.kwargs["*"],
+        "POST": {
+            # add "ndjson" option to stream one result per line as they are ready
+            "format": {
+                "type": str,
+                "default": "json",
+                "enum": ("json", "yaml", "html", "msgpack", "ndjson"),
+            },
+        },
+    }
+
+    def get_batch_items(self):
+        body = self.get_body_data()
+        if not isinstance(body, dict):
+            raise HTTPError(400, reason="Request body must be an object with a list of \"urls\" and/or \"documents\".")
+        urls, documents = body.get("urls") or [], body.get("documents") or []
+        if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+            raise HTTPError(400, reason="\"urls\" must be a list of urls.")
+        if not isinstance(documents, list):
+            raise HTTPError(400, reason="\"documents\" must be a list of SmartAPI documents.")
+        items = [{"url": url} for url in urls] + [{"document": document} for document in documents]
+        if not items:
+            raise HTTPError(400, reason="Request body must provide at least one url or document.")
+        max_items = getattr(self.biothings.config, "METAKG_PARSE_BATCH_MAX_ITEMS", 100)
+        if len(items) > max_items:
+            raise HTTPError(400, reason=f"A batch request accepts at most {max_items} urls and documents.")
+        return items
+
+    async def parse_batch_item(self, index, item, semaphore):
+        """Return the result of one url or document, errors are reported in the result."""
+        result = {"index": index}
+        url = item.get("url")
+        if url:
+            result["url"] = url
+        try:
+            if not url and not isinstance(item["document"], dict):
+                raise TypeError("Not a SmartAPI document.")
+            async with semaphore:
+                parsed_metakg = await self.parse_metakg(data=item.get("document"), url=url)
+        except DownloadError as err:
+            result["error"] = {
+                "code": 400,
+                "reason": "There was an error downloading the data from the given url.",
+                "message": str(err),
+            }
+        except (ValueError, TypeError) as err:
+            result["error"] = {
+                "code": 400,
+                "reason": "The data is not a valid JSON or YAML object.",
+                "message": str(err),
+            }
+        except Exception as err:  # pylint: disable=broad-except
+            logger.warning("Failed to parse batch item %s: %s", index, err)
+            result["error"] = {"code": 500, "reason": "Failed to parse the metadata.", "message": str(err)}
+        else:
+            hits = self.filter_metakg(parsed_metakg, url=url)
+            result["total"] = len(hits)
+            result["hits"] = hits
+        return result
+
+    async def post(self, *args, **kwargs):
+        items = self.get_batch_items()
+        semaphore = asyncio.Semaphore(getattr(self.biothings.config, "METAKG_PARSE_BATCH_CONCURRENCY", 8))
+        tasks = [asyncio.ensure_future(self.parse_batch_item(i, item, semaphore)) for i, item in enumerate(items)]
+
+        if self.format != "ndjson":
+            results = await asyncio.gather(*tasks)
+            self.finish({"total": len(results), "hits": results})
+            return
+
+        self.set_header("Content-Type", "application/x-ndjson; charset=UTF-8")
+        errors = 0
+        try:
+            for task in asyncio.as_completed(tasks):
+                result = await task
+                errors += "error" in result
+                # bypass format handling of BaseAPIHandler.write
+                super(BaseAPIHandler, self).write(serializer.to_json(result) + "\n")
+                await self.flush()
+        except StreamClosedError:
+            logger.info("Client closed the connection while streaming batch results.")
+            for task in tasks:
+                task.cancel()
+            return
+        # the last line summarizes the results
+        super(BaseAPIHandler, self).write(serializer.to_json({"total": len(tasks), "errors": errors}) + "\n")
+        self.finish()
@@ -1,4 +1,4 @@
-from .metakg import ConsolidatedMetaKGDoc, MetaKGDoc
+from .metakg import ConsolidatedMetaKGDoc, MetaKGDoc, MetaKGOperationDoc
 from .smartapi import SmartAPIDoc
 
-__all__ = [MetaKGDoc, SmartAPIDoc, ConsolidatedMetaKGDoc]
+__all__ = [MetaKGDoc, SmartAPIDoc, ConsolidatedMetaKGDoc, MetaKGOperationDoc]
@@ -2,7 +2,7 @@
     Elasticsearch Document Object Model for MetaKG
 """
 
-from config import ES_INDICES
+from config import ES_INDICES, METAKG_OPERATIONS_ES_INDEX
 from elasticsearch_dsl import InnerDoc, Keyword, Object, Text, analysis, mapping
 
 from .base import BaseDoc
@@ -83,6 +83,7 @@ class APIInnerDoc(InnerDoc):
     smartapi = Object(SmartAPIInnerDoc)
     tags = lowercase_keyword_copy_to_all
     provided_by = default_text
+    bte_ref = Keyword(index=False)  # hash of the BTE operation payload, only aggregated, see MetaKGOperationDoc
     # We cannot define "x-translator" field here due the "-" in the name,
     # so we will have it indexed via the dynamic templates
 
@@ -130,3 +131,23 @@ class ConsolidatedMetaKGDoc(MetaKGDoc):
             "index.mapping.ignore_malformed": True,
             "index.mapping.total_fields.limit": 2500,
         }
+
+
+class MetaKGOperationDoc(BaseDoc):
+    """BTE operation payloads ("query_operation" and "response_mapping") of MetaKG edges.
+    Each distinct payload is stored once, its _id is the content hash referenced by api.bte_ref.
+    Payloads no longer referenced are pruned when old index generations are deleted,
+    see SmartAPI.prune_metakg_operations.
+    """
+    bte = Object(enabled=False)  # stored only, never searched
+
+    class Index:
+        """
+        Index Settings
+        """
+
+        name = METAKG_OPERATIONS_ES_INDEX
+        settings = {
+            "number_of_shards": 1,
+            "number_of_replicas": 0,
+        }
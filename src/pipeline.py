@@ -3,10 +3,13 @@ from enum import Enum
 from typing import Dict, OrderedDict
 
 from biothings.web.query import AsyncESQueryBackend, AsyncESQueryPipeline, ESQueryBuilder, ESResultFormatter
+from biothings.web.query.pipeline import capturesESExceptions
 from elasticsearch_dsl import Q, Search
 
 from controller.base import OpenAPI, Swagger
+from model import MetaKGOperationDoc
 from utils import decoder
+from utils.metakg.bte import get_bte_refs, hydrate_apis
 
 
 # There are three types of cases supported:
@@ -281,3 +284,27 @@ class MetaKGQueryPipeline(AsyncESQueryPipeline):
                     ns.config.AVAILABLE_FIELDS_EXCLUDED,
                 )
         super().__init__(*args, **kwargs)
+
+    @capturesESExceptions
+    async def search(self, q, **options):
+        # hydration queries elasticsearch as well, its errors are mapped
+        # to the pipeline error responses like those of the search itself.
+        result = await super().search(q, **options)
+        if options.get("bte") and isinstance(result, dict) and result.get("hits"):
+            await self.hydrate_bte(result["hits"])
+        return result
+
+    async def hydrate_bte(self, hits):
+        """
+        Replace the api.bte_ref references of the hits by the BTE operation payloads
+        they reference, fetched in a single request from the MetaKGOperation index.
+        """
+        bte_refs = set()
+        for hit in hits:
+            bte_refs |= get_bte_refs(hit.get("api", []))
+        if not bte_refs:
+            return
+        response = await self.backend.client.mget(index=MetaKGOperationDoc.Index.name, ids=list(bte_refs))
+        operations = {doc["_id"]: doc["_source"]["bte"] for doc in response["docs"] if doc.get("found")}
+        for hit in hits:
+            hydrate_apis(hit.get("api", []), operations)
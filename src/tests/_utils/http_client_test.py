@@ -0,0 +1,95 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from utils import http_client, monitor
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address))
+        self.server.cookies.append(self.headers.get("Cookie"))
+        if self.path == "/hang":
+            time.sleep(1)
+        if self.path == "/unavailable" and len(self.server.requests) < 3:
+            status, body = 503, b"unavailable"
+        else:
+            status, body = 200, b"ok"
+        self.send_response(status)
+        self.send_header("Set-Cookie", "session=abc; Path=/")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.requests = []
+        self.server.cookies = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://localhost:{self.server.server_address[1]}"
+        self.session = http_client.create_session(backoff_factor=0)
+        http_client.dns_cache.clear()
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.assertEqual(self.session.get(self.url + "/", timeout=5).text, "ok")
+        # all the requests were sent over the same connection
+        self.assertEqual(len({address for _, address in self.server.requests}), 1)
+
+    def test_retry(self):
+        response = self.session.get(self.url + "/unavailable", timeout=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_dns_cache(self):
+        with mock.patch("socket.getaddrinfo", wraps=http_client.socket.getaddrinfo) as getaddrinfo:
+            for _ in range(2):
+                self.session.get(self.url + "/", headers={"Connection": "close"}, timeout=5)
+        # two connections, one resolution
+        self.assertEqual(len({address for _, address in self.server.requests}), 2)
+        resolved = [call for call in getaddrinfo.call_args_list if call.args[0] == "localhost"]
+        self.assertEqual(len(resolved), 1)
+
+    def test_no_status_retry(self):
+        session = http_client.create_session(retry_statuses=())
+        self.assertEqual(session.get(self.url + "/unavailable", timeout=5).status_code, 503)
+        self.assertEqual(len(self.server.requests), 1)
+        session.close()
+
+    def test_no_read_retry(self):
+        with self.assertRaises(requests.ReadTimeout):
+            self.session.get(self.url + "/hang", timeout=0.2)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_no_retry(self):
+        session = http_client.create_session(retries=0)
+        self.assertEqual(session.get(self.url + "/unavailable", timeout=5).status_code, 503)
+        self.assertEqual(len(self.server.requests), 1)
+        session.close()
+        # nor connection errors for the uptime checks
+        self.assertEqual(monitor.get_monitor_session().get_adapter(self.url).max_retries.total, 0)
+
+    def test_no_cookies(self):
+        for _ in range(2):
+            self.session.get(self.url + "/", timeout=5)
+        self.assertEqual(len(self.session.cookies), 0)
+        self.assertEqual(self.server.cookies, [None, None])
+
+    def test_named_sessions(self):
+        self.assertIs(http_client.get_session(), http_client.get_session())
+        self.assertIsNot(http_client.get_session("other", retry_statuses=()), http_client.get_session())
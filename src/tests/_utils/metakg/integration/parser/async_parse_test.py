@@ -0,0 +1,86 @@
+import json
+import os
+import time
+
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+from utils.metakg.parser import MetaKGParser, get_host_semaphore
+
+EDGES = [
+    {"subject": "biolink:Gene", "object": "biolink:Disease", "predicate": "biolink:related_to"},
+    {"subject": "biolink:Gene", "object": "biolink:Disease", "predicate": "biolink:causes"},
+]
+
+
+class MetaKGHandler(RequestHandler):
+    def get(self, kind):
+        if kind == "invalid":
+            self.write("[]")
+        elif kind == "error":
+            self.set_status(500)
+        else:
+            self.write({"edges": EDGES})
+
+
+class TestAsyncParser(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([(r"/(\w+)/meta_knowledge_graph", MetaKGHandler)])
+
+    def trapi_doc(self, kind):
+        return {
+            "openapi": "3.0.0",
+            "info": {
+                "title": "Example KP",
+                "version": "1.0",
+                "x-translator": {"component": "KP", "team": ["Example Team"]},
+            },
+            "servers": [{"url": self.get_url(f"/{kind}")}],
+            "tags": [{"name": "trapi"}, {"name": "translator"}],
+            "paths": {"/meta_knowledge_graph": {"get": {}}, "/query": {"post": {}}},
+        }
+
+    @gen_test
+    async def test_trapi(self):
+        parser = MetaKGParser()
+        edges = await parser.get_metakg_async(self.trapi_doc("ok"))
+        self.assertEqual([edge["predicate"] for edge in edges], ["related_to", "causes"])
+        self.assertEqual(edges[0]["api"]["bte"]["query_operation"]["server"], self.get_url("/ok"))
+        self.assertEqual(parser.metakg_errors, {})
+
+    @gen_test
+    async def test_trapi_errors(self):
+        parser = MetaKGParser()
+        self.assertEqual(await parser.get_metakg_async(self.trapi_doc("invalid")), [])
+        self.assertEqual(parser.metakg_errors, {"Invalid response type": [self.get_url("/invalid")]})
+        self.assertEqual(await parser.get_metakg_async(self.trapi_doc("error")), [])
+        self.assertEqual(parser.metakg_errors, {repr(Exception("Not Found")): [self.get_url("/error")]})
+
+    @gen_test
+    async def test_host_limit(self):
+        parser = MetaKGParser()
+        # all the requests to the server are taken, e.g. by a MetaKG refresh
+        semaphore = get_host_semaphore(self.get_url("/ok"), parser.max_requests_per_host)
+        for _ in range(parser.max_requests_per_host):
+            semaphore.acquire()
+
+        def _release():
+            for _ in range(parser.max_requests_per_host):
+                semaphore.release()
+
+        IOLoop.current().call_later(0.3, _release)
+        start = time.monotonic()
+        edges = await parser.get_metakg_async(self.trapi_doc("ok"))
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        self.assertEqual(len(edges), 2)
+
+    @gen_test
+    async def test_non_trapi(self):
+        mygene_file_path = os.path.abspath(
+            os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "data", "mygene.json")
+        )
+        with open(mygene_file_path, encoding="utf-8") as f:
+            mygene_doc = json.load(f)
+        edges = await MetaKGParser().get_metakg_async(mygene_doc)
+        self.assertEqual(edges, MetaKGParser().get_metakg(mygene_doc))
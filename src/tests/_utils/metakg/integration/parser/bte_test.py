@@ -0,0 +1,30 @@
+import unittest
+
+from utils.metakg.bte import dehydrate_edge, get_bte_refs, hydrate_apis
+
+
+class TestBTEOperations(unittest.TestCase):
+    def make_edge(self, path):
+        return {
+            "subject": "Gene",
+            "object": "Disease",
+            "predicate": "related_to",
+            "api": {"name": "api1", "bte": {"query_operation": {"path": path}}},
+        }
+
+    def test_dehydrate_edge(self):
+        edges = [self.make_edge("/query"), self.make_edge("/query"), self.make_edge("/other")]
+        operations = dict(dehydrate_edge(edge) for edge in edges)
+        self.assertEqual(len(operations), 2)
+        self.assertNotIn("bte", edges[0]["api"])
+        self.assertEqual(edges[0]["api"]["bte_ref"], edges[1]["api"]["bte_ref"])
+        self.assertIsNone(dehydrate_edge({"api": {"name": "api2"}}))
+
+    def test_hydrate_apis(self):
+        edge = self.make_edge("/query")
+        bte_ref, bte = dehydrate_edge(edge)
+        apis = [edge["api"], {"name": "api2"}]
+        self.assertEqual(get_bte_refs(apis), {bte_ref})
+        hydrate_apis(apis, {bte_ref: bte})
+        self.assertEqual(apis[0], self.make_edge("/query")["api"])
+        self.assertEqual(apis[1], {"name": "api2"})
@@ -26,3 +26,20 @@ class TestComponent(unittest.TestCase):
             cp_obj = Components(components)
             rec = cp_obj.fetch_component_by_ref("#/components/x-bte-response-mapping/hello/world")
             self.assertEqual(rec, None)
+
+    def test_nested_refs(self):
+        cp_obj = Components(
+            {
+                "x-bte-kgs-operations": {
+                    "op": [{"predicate": "related_to", "response_mapping": {"$ref": "#/components/x-bte-response-mapping/rm"}}],
+                    "loop": {"next": {"$ref": "#/components/x-bte-kgs-operations/loop"}},
+                },
+                "x-bte-response-mapping": {"rm": {"related_to": "hits"}},
+            }
+        )
+        rec = cp_obj.fetch_component_by_ref("#/components/x-bte-kgs-operations/op")
+        self.assertEqual(rec[0]["response_mapping"], {"related_to": "hits"})
+        self.assertIs(cp_obj.fetch_component_by_ref("#/components/x-bte-kgs-operations/op"), rec)
+        # a circular ref is kept as is
+        rec = cp_obj.fetch_component_by_ref("#/components/x-bte-kgs-operations/loop")
+        self.assertEqual(rec, {"next": {"$ref": "#/components/x-bte-kgs-operations/loop"}})
@@ -0,0 +1,30 @@
+import unittest
+
+from utils.metakg.consolidation import EdgeConsolidator
+
+
+def make_edge(subject, predicate, object, api_name):
+    return {
+        "subject": subject,
+        "predicate": predicate,
+        "object": object,
+        "api": {"name": api_name, "smartapi": {"id": api_name}},
+    }
+
+
+class TestEdgeConsolidator(unittest.TestCase):
+    def test_consolidation(self):
+        consolidator = EdgeConsolidator()
+        consolidator.add(make_edge("Gene", "related_to", "Disease", "api1"))
+        consolidator.add(make_edge("Gene", "related_to", "Disease", "api2"))
+        consolidator.add(make_edge("Gene", "related_to", "Disease", "api1"))
+        consolidator.add({**make_edge("Gene", "causes", "Disease", "api1"), "subject_prefix": ["NCBIGene"]})
+        self.assertEqual(len(consolidator), 2)
+
+        groups = {group["_id"]: group for group in consolidator.pop_groups()}
+        self.assertEqual(len(consolidator), 0)
+        self.assertEqual(
+            [api["name"] for api in groups["Gene-related_to-Disease"]["api"]],
+            ["api1", "api2"],
+        )
+        self.assertEqual(groups["Gene-causes-Disease"]["subject_prefix"], ["NCBIGene"])
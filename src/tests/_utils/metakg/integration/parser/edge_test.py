@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+
+from utils.metakg.consolidation import EdgeConsolidator
+from utils.metakg.edge import EdgeAPI, EdgeAPICache
+from utils.metakg.parser import MetaKGParser
+
+METADATA = {
+    "url": "https://trapi.example.org",
+    "title": "Example KP",
+    "tags": ["trapi"],
+    "smartapi": {"id": "x"},
+    "x-translator": {"component": "KP", "team": ["Example Team"]},
+}
+TRAPI_EDGES = [
+    {"subject": "biolink:Gene", "object": "biolink:Disease", "predicate": "biolink:related_to"},
+    {"subject": "biolink:Gene", "object": "biolink:Disease", "predicate": "biolink:causes"},
+]
+
+
+class TestMetaKGEdge(unittest.TestCase):
+    def setUp(self):
+        self.parser = MetaKGParser()
+        ops = self.parser.iter_trapi_ops(TRAPI_EDGES, METADATA)
+        self.edges = list(self.parser.iter_metakgedges(ops))
+
+    def test_shared_api(self):
+        self.assertIs(self.edges[0].api, self.edges[1].api)
+        self.assertIs(self.edges[0].subject, self.edges[1].subject)
+
+    def test_shared_tags(self):
+        ops = list(self.parser.iter_trapi_ops(TRAPI_EDGES, METADATA))
+        self.assertIs(ops[0]["tags"], ops[1]["tags"])
+        self.assertIs(ops[0]["tags"], ops[0]["query_operation"]["tags"])
+
+    def test_api_cache(self):
+        cache = EdgeAPICache()
+        with mock.patch("utils.metakg.edge.EdgeAPI", wraps=EdgeAPI) as edge_api:
+            # equal, but distinct, x-translator dicts
+            apis = [cache.get_api("KP", "url", "x", ["trapi"], {"team": ["A"]}) for _ in range(3)]
+            other = cache.get_api("KP", "url", "x", ["trapi"], {"team": ["B"]})
+            self.assertIs(cache.get_api("KP", "url", "x", ["trapi"], {"team": ["A"]}), apis[0])
+        # built on a miss only
+        self.assertEqual(edge_api.call_count, 2)
+        self.assertIs(apis[0], apis[2])
+        self.assertNotEqual(apis[0], other)
+
+    def test_to_dict(self):
+        ops = self.parser.parse_trapi_metakg_endpoint({"edges": TRAPI_EDGES}, METADATA)
+        self.assertEqual([edge.to_dict() for edge in self.edges], self.parser.extract_metakgedges(ops))
+        edge = self.edges[0].to_dict()
+        self.assertEqual(edge["api"]["tags"], ["trapi", "bte-trapi"])
+        self.assertEqual(edge["api"]["bte"]["query_operation"]["server"], "https://trapi.example.org")
+        # the dicts do not share the api metadata
+        edge["api"]["x-translator"]["team"].append("Other Team")
+        self.assertEqual(self.edges[1].to_dict()["api"]["x-translator"]["team"], ["Example Team"])
+
+    def test_dehydrate(self):
+        bte_ref, bte = self.edges[0].dehydrate()
+        edge = self.edges[0].to_dict()
+        self.assertNotIn("bte", edge["api"])
+        self.assertEqual(edge["api"]["bte_ref"], bte_ref)
+        self.assertEqual(bte["query_operation"]["path"], "/query")
+
+    def test_consolidation(self):
+        consolidator = EdgeConsolidator()
+        for edge in [*self.edges, self.edges[0]]:
+            consolidator.add(edge)
+        groups = {group["_id"]: group for group in consolidator.pop_groups()}
+        self.assertEqual(len(groups["Gene-related_to-Disease"]["api"]), 1)
+        self.assertEqual(groups["Gene-causes-Disease"]["api"][0]["name"], "Example KP")
@@ -0,0 +1,136 @@
+import threading
+import unittest
+from unittest import mock
+
+from utils.metakg.graph import MetaKGGraph, MetaKGGraphStore
+
+
+class TestMetaKGGraph(unittest.TestCase):
+    def setUp(self):
+        self.graph = MetaKGGraph()
+        self.graph.add_edge("Gene", "Disease", "related_to", [{"name": "api1"}])
+        self.graph.add_edge("Gene", "Disease", "causes", [{"name": "api2"}])
+        self.graph.add_edge("Gene", "Protein", "related_to", [{"name": "api1"}])
+        self.graph.add_edge("Protein", "Disease", "related_to", [{"name": "api3"}])
+        self.graph.add_edge("Disease", "Gene", "related_to", [{"name": "api1"}])
+        self.graph.freeze()
+
+    def get_paths(self, subject, object, cutoff):
+        graph = self.graph
+        paths = graph.iter_paths([graph.node_id(subject)], [graph.node_id(object)], cutoff)
+        return [[graph.nodes[node_id] for node_id in path] for path, _ in paths]
+
+    def test_nodes(self):
+        self.assertEqual(len(self.graph), 3)
+        self.assertIn("Gene", self.graph)
+        self.assertNotIn("Chemical", self.graph)
+
+    def test_csr_arrays(self):
+        gene = self.graph.node_id("Gene")
+        targets = [self.graph.nodes[self.graph.indices[k]] for k in self.graph.slots(gene)]
+        self.assertEqual(targets, ["Disease", "Protein"])
+        self.assertEqual(len(self.graph.edge_predicates), 5)
+        self.assertEqual(len(self.graph.edge_apis), 5)
+
+    def test_edge_data(self):
+        slot = self.graph.slots(self.graph.node_id("Gene"))[0]
+        predicates = [predicate for predicate, _ in self.graph.edge_data(slot)]
+        self.assertEqual(predicates, ["related_to", "causes"])
+
+    def test_iter_paths(self):
+        self.assertEqual(self.get_paths("Gene", "Disease", 1), [["Gene", "Disease"]])
+        self.assertEqual(
+            self.get_paths("Gene", "Disease", 2),
+            [["Gene", "Disease"], ["Gene", "Protein", "Disease"]],
+        )
+        self.assertEqual(self.get_paths("Disease", "Protein", 3), [["Disease", "Gene", "Protein"]])
+        self.assertEqual(self.get_paths("Gene", "Gene", 3), [])
+
+    def test_iter_paths_bidirectional(self):
+        self.graph = MetaKGGraph()
+        edges = [("A", "B"), ("A", "C"), ("B", "C"), ("C", "D"), ("B", "D"), ("D", "E"), ("C", "E"), ("E", "A")]
+        for subject, object in edges:
+            self.graph.add_edge(subject, object, "related_to", [])
+        self.graph.freeze()
+        source, target = [self.graph.node_id("A")], [self.graph.node_id("E")]
+        for cutoff in range(1, 6):
+            self.assertEqual(
+                list(self.graph.iter_paths(source, target, cutoff, bidirectional=True)),
+                list(self.graph.iter_paths(source, target, cutoff, bidirectional=False)),
+            )
+
+    def test_iter_paths_multiple_sources_and_targets(self):
+        graph = self.graph
+        sources = [graph.node_id("Gene"), graph.node_id("Protein")]
+        targets = [graph.node_id("Disease"), graph.node_id("Protein")]
+        paths = graph.iter_paths(sources, targets, 2)
+        self.assertEqual(
+            [[graph.nodes[node_id] for node_id in path] for path, _ in paths],
+            [["Gene", "Disease"], ["Gene", "Protein"], ["Gene", "Protein", "Disease"], ["Protein", "Disease"]],
+        )
+
+    def test_iter_paths_with_predicates(self):
+        graph = self.graph
+        source, target = [graph.node_id("Gene")], [graph.node_id("Disease")]
+        for bidirectional in (False, True):
+            causes = graph.iter_paths(source, target, 3, bidirectional, predicates=[graph.predicate_ids["causes"]])
+            self.assertEqual([path for path, _ in causes], [(graph.node_id("Gene"), graph.node_id("Disease"))])
+            self.assertEqual(list(graph.iter_paths(source, target, 3, bidirectional, predicates=[])), [])
+
+    def test_reachability(self):
+        graph = self.graph
+        gene, protein, disease = graph.node_id("Gene"), graph.node_id("Protein"), graph.node_id("Disease")
+        self.assertTrue(graph.reachable(gene, 1) >> protein & 1)
+        self.assertTrue(graph.has_path([disease], [protein], 2))
+        self.assertFalse(graph.has_path([disease], [protein], 1))
+        self.assertEqual(graph.reachable(gene, graph.reachability_max_hops + 1), -1)
+        self.assertEqual(list(graph.iter_paths([disease], [protein], 1)), [])
+
+
+class TestMetaKGGraphStore(unittest.TestCase):
+    def setUp(self):
+        self.store = MetaKGGraphStore()
+        self.version = "v1"
+        self.building = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        patchers = [
+            mock.patch("utils.metakg.graph.get_build_version", side_effect=lambda: self.version),
+            mock.patch.object(MetaKGGraph, "build", side_effect=self.build),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def build(self, version=None):
+        self.building.set()
+        self.release.wait(5)
+        return MetaKGGraph(version=version)
+
+    def test_get(self):
+        graph = self.store.get()
+        self.assertEqual(graph.version, "v1")
+        self.assertIs(self.store.get(), graph)
+
+    def test_rebuild_does_not_block(self):
+        old_graph = self.store.get()
+        self.store._checked_at = 0
+        self.version, self.building, self.release = "v2", threading.Event(), threading.Event()
+        rebuilt = []
+        thread = threading.Thread(target=lambda: rebuilt.append(self.store.get()))
+        thread.start()
+        self.assertTrue(self.building.wait(5))
+        # the current graph is returned while another thread rebuilds
+        self.assertIs(self.store.get(), old_graph)
+        self.release.set()
+        thread.join(5)
+        self.assertEqual(rebuilt[0].version, "v2")
+        self.assertIs(self.store.get(), rebuilt[0])
+
+    def test_rebuild_error(self):
+        old_graph = self.store.get()
+        self.store._checked_at = 0
+        self.version = "v2"
+        with mock.patch.object(MetaKGGraph, "build", side_effect=ConnectionError):
+            with self.assertLogs("metakg_graph", level="ERROR"):
+                self.assertIs(self.store.get(), old_graph)
@@ -1,8 +1,10 @@
 import json
 import os
 import unittest
+from unittest import mock
 
 from utils.metakg.api import API
+from utils.metakg.endpoint import Endpoint
 
 
 class TestAPIParser(unittest.TestCase):
@@ -72,3 +74,19 @@ class TestAPIParserUsingSpecsWithParameters(unittest.TestCase):
             litvar = API(smartapi_spec)
             path_params = litvar.metadata["operations"][0]["query_operation"]["path_params"]
             self.assertEqual(path_params, ["variantid"])
+
+
+class TestAPIParserMemoized(unittest.TestCase):
+    def test_operations_extracted_once(self):
+        mygene_file_path = os.path.abspath(
+            os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "data", "mygene.json")
+        )
+        with open(mygene_file_path, encoding="utf-8") as f:
+            mygene = API(json.load(f))
+        with mock.patch.object(Endpoint, "iter_endpoint_info", autospec=True, wraps=Endpoint.iter_endpoint_info) as walk:
+            self.assertEqual(mygene.api_meta["title"], "MyGene.info API")
+            self.assertEqual(walk.call_count, 0)
+            metadata = mygene.metadata
+            self.assertIs(mygene.metadata, metadata)
+            self.assertIs(metadata["operations"], mygene.operations)
+            self.assertEqual(walk.call_count, len(mygene.smartapi_doc["paths"]))
@@ -0,0 +1,34 @@
+import json
+import unittest
+
+from utils.metakg.json_stream import iter_json_array
+
+DOCUMENT = {
+    "nodes": {"biolink:Gene": {"id_prefixes": ["NCBIGene", "ENSEMBL"]}},
+    "edges": [
+        {"subject": "biolink:Gene", "object": "biolink:Disease", "predicate": "biolink:related_to"},
+        {"subject": "biolink:Gene", "object": "biolink:Protein", "predicate": "biolink:has_gene_product", "n": 1.5e3},
+    ],
+    "note": "é ✓",
+}
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestIterJSONArray(unittest.TestCase):
+    def test_chunked(self):
+        data = json.dumps(DOCUMENT, ensure_ascii=False).encode()
+        for size in (1, 3, 7, len(data)):
+            self.assertEqual(list(iter_json_array(chunked(data, size), "edges")), DOCUMENT["edges"])
+
+    def test_missing_or_empty(self):
+        self.assertEqual(list(iter_json_array([b'{"nodes": {}}'], "edges")), [])
+        self.assertEqual(list(iter_json_array([b'{"edges": [ ]}'], "edges")), [])
+        self.assertEqual(list(iter_json_array([b"{}"], "edges")), [])
+
+    def test_invalid(self):
+        for data in (b"[]", b'{"edges": [{"subject": "biolink:Gene"}', b'{"edges": [1, 2}', b""):
+            with self.assertRaises(ValueError):
+                list(iter_json_array(chunked(data, 4), "edges"))
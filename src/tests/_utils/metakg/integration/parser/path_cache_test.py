@@ -0,0 +1,42 @@
+import unittest
+
+from utils.metakg.graph import MetaKGGraph
+from utils.metakg.path_finder import PathResultCache
+
+
+class TestPathResultCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = PathResultCache(max_edges=10)
+        self.graph = MetaKGGraph().freeze()
+
+    def test_make_key(self):
+        self.assertEqual(
+            PathResultCache.make_key("Gene", "Disease", 3, ["causes", "treats"], ["node"], size=10),
+            PathResultCache.make_key("Gene", "Disease", 3, ["treats", "causes", "treats"], ["node"], size=10),
+        )
+        self.assertNotEqual(
+            PathResultCache.make_key("Gene", "Disease", 3, size=10),
+            PathResultCache.make_key("Gene", "Disease", 3, size=20),
+        )
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get(self.graph, "a"))
+        self.cache.set(self.graph, "a", {"total": 0}, 0)
+        self.assertEqual(self.cache.get(self.graph, "a"), {"total": 0})
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_eviction(self):
+        self.cache.set(self.graph, "a", "A", 4)
+        self.cache.set(self.graph, "b", "B", 4)
+        self.cache.get(self.graph, "a")
+        self.cache.set(self.graph, "c", "C", 4)
+        self.assertIsNone(self.cache.get(self.graph, "b"))
+        self.assertEqual(self.cache.get(self.graph, "a"), "A")
+        # too large to be cached at all
+        self.cache.set(self.graph, "d", "D", 10)
+        self.assertIsNone(self.cache.get(self.graph, "d"))
+
+    def test_graph_change(self):
+        self.cache.set(self.graph, "a", "A", 1)
+        self.assertIsNone(self.cache.get(MetaKGGraph().freeze(), "a"))
+        self.assertEqual(self.cache.stats()["entries"], 0)
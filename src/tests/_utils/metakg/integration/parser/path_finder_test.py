@@ -0,0 +1,48 @@
+import unittest
+
+from utils.metakg.graph import MetaKGGraph
+from utils.metakg.path_finder import MetaKGPathFinder
+
+
+class TestMetaKGPathFinderPages(unittest.TestCase):
+    def setUp(self):
+        graph = MetaKGGraph()
+        graph.add_edge("Gene", "Disease", "related_to", [{"name": "api1", "smartapi": {"id": "api1"}}])
+        for node in ["Protein", "Chemical", "Pathway"]:
+            graph.add_edge("Gene", node, "related_to", [{"name": "api1", "smartapi": {"id": "api1"}}])
+            graph.add_edge(node, "Disease", "related_to", [{"name": "api2", "smartapi": {"id": "api2"}}])
+        graph.freeze()
+        self.path_finder = MetaKGPathFinder(
+            expanded_fields={"subject": ["Gene"], "object": ["Disease"]}, graph=graph
+        )
+        self.all_paths = self.get_paths()
+
+    def get_paths(self, **page):
+        return [data["path"] for data in self.path_finder.iter_paths(cutoff=2, **page)]
+
+    def test_all_paths(self):
+        self.assertEqual(len(self.all_paths), 4)
+        self.assertFalse(self.path_finder.truncated)
+
+    def test_page(self):
+        self.assertEqual(self.get_paths(size=2, from_=1), self.all_paths[1:3])
+        self.assertTrue(self.path_finder.truncated)
+
+    def test_from_past_the_end(self):
+        self.assertEqual(self.get_paths(size=2, from_=10), [])
+        self.assertFalse(self.path_finder.truncated)
+
+    def test_exact_count(self):
+        # enumeration reaches the stop value with no path left, nothing was cut off
+        self.assertEqual(self.get_paths(size=2, from_=2), self.all_paths[2:])
+        self.assertFalse(self.path_finder.truncated)
+        self.assertEqual(self.get_paths(max_paths=4), self.all_paths)
+        self.assertFalse(self.path_finder.truncated)
+
+    def test_max_paths(self):
+        self.assertEqual(self.get_paths(max_paths=3), self.all_paths[:3])
+        self.assertTrue(self.path_finder.truncated)
+        self.assertEqual(self.get_paths(size=10, max_paths=2), self.all_paths[:2])
+        self.assertTrue(self.path_finder.truncated)
+        self.assertEqual(self.get_paths(size=2, from_=1, max_paths=2), self.all_paths[1:2])
+        self.assertTrue(self.path_finder.truncated)
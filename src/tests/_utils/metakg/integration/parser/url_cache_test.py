@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from utils.metakg.parser import MetaKGParser
+from utils.metakg.url_cache import MetaKGURLCache
+
+METAKG = {
+    "nodes": {},
+    "edges": [{"subject": "biolink:Gene", "object": "biolink:Disease", "predicate": "biolink:related_to"}],
+}
+METADATA = {"url": "https://trapi.example.org", "title": "Example KP", "tags": ["trapi"], "smartapi": {"id": "x"}}
+
+
+class TestMetaKGURLCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.parser = MetaKGParser()
+        self.parser.metakg_errors = {}
+        self.parser.url_cache = MetaKGURLCache(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def mock_response(self, status_code, etag=None):
+        response = mock.Mock(status_code=status_code, headers={"ETag": etag} if etag else {})
+        response.content = json.dumps(METAKG).encode()
+        response.json.side_effect = lambda: json.loads(response.content)
+        response.iter_content.side_effect = lambda chunk_size: iter([response.content])
+        return response
+
+    def test_not_modified(self):
+        with mock.patch("requests.Session.get", return_value=self.mock_response(200, etag='"v1"')) as get:
+            ops = self.parser.get_ops_from_metakg_endpoint(METADATA)
+        self.assertEqual(len(ops), 1)
+        self.assertEqual(get.call_args.kwargs["headers"], {})
+
+        with mock.patch("requests.Session.get", return_value=self.mock_response(304)) as get:
+            self.assertEqual(self.parser.get_ops_from_metakg_endpoint(METADATA), ops)
+        self.assertEqual(get.call_args.kwargs["headers"], {"If-None-Match": '"v1"'})
+
+    def test_modified(self):
+        with mock.patch("requests.Session.get", return_value=self.mock_response(200)):
+            self.parser.get_ops_from_metakg_endpoint(METADATA)
+        ops_file = self.parser.url_cache.get(METADATA["url"])["ops_file"]
+        response = self.mock_response(200)
+        response.content = json.dumps({"edges": METAKG["edges"] * 2}).encode()
+        with mock.patch("requests.Session.get", return_value=response):
+            self.assertEqual(len(self.parser.get_ops_from_metakg_endpoint(METADATA)), 2)
+        entry = self.parser.url_cache.get(METADATA["url"])
+        self.assertNotEqual(entry["ops_file"], ops_file)
+        self.assertEqual(len(list(self.parser.url_cache.iter_ops(entry))), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, ops_file)))
+
+    def failing_response(self):
+        response = self.mock_response(200)
+        content = json.dumps({"edges": METAKG["edges"] * 3}).encode()
+
+        def _iter_content(chunk_size):
+            yield content[: len(content) // 2]
+            raise requests.ConnectionError("Connection reset")
+
+        response.iter_content.side_effect = _iter_content
+        return response
+
+    def test_stream_error(self):
+        with mock.patch("requests.Session.get", return_value=self.mock_response(200)):
+            ops = self.parser.get_ops_from_metakg_endpoint(METADATA)
+        # the last complete operations are used, not the partial ones
+        with mock.patch("requests.Session.get", return_value=self.failing_response()):
+            self.assertEqual(self.parser.get_ops_from_metakg_endpoint(METADATA), ops)
+        self.assertEqual(len(self.parser.metakg_errors), 1)
+
+    def test_stream_error_without_cache(self):
+        self.parser.url_cache = None
+        with mock.patch("requests.Session.get", return_value=self.failing_response()):
+            self.assertEqual(self.parser.get_ops_from_metakg_endpoint(METADATA), [])
+
+    def test_metadata_change(self):
+        with mock.patch("requests.Session.get", return_value=self.mock_response(200, etag='"v1"')):
+            self.parser.get_ops_from_metakg_endpoint(METADATA)
+        metadata = {**METADATA, "title": "Renamed KP"}
+        with mock.patch("requests.Session.get", return_value=self.mock_response(200, etag='"v1"')) as get:
+            ops = self.parser.get_ops_from_metakg_endpoint(metadata)
+        self.assertEqual(get.call_args.kwargs["headers"], {})
+        self.assertEqual(ops[0]["association"]["api_name"], "Renamed KP")
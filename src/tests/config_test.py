@@ -5,5 +5,6 @@ ES_INDICES = {
     "metakg": "smartapi_metakg_docs_test",
     "metakg_consolidated": "smartapi_metakg_docs_consolidated_test"
 }
+METAKG_OPERATIONS_ES_INDEX = "smartapi_metakg_operations_test"
 
 COOKIE_SECRET = "test_secret"
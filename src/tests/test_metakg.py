@@ -0,0 +1,447 @@
+"""
+    MetaKG Index Tests
+
+    The SmartAPI documents are indexed like in test_controller.py, mygene
+    is a regular API and mychem stands for a TRAPI. Their metakg edges are
+    stubbed, so that no TRAPI server is requested.
+
+    The MetaKG indices are built under the test index names of config_test.py.
+
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import admin
+import pytest
+from biothings.web.query.pipeline import QueryPipelineException
+from config_test import ES_INDICES, METAKG_OPERATIONS_ES_INDEX
+from controller.smartapi import SmartAPI
+from elasticsearch.exceptions import ConnectionError
+from elasticsearch_dsl import connections
+from model import ConsolidatedMetaKGDoc, MetaKGDoc, MetaKGOperationDoc, SmartAPIDoc
+from pipeline import MetaKGQueryPipeline
+from utils import decoder, indices
+from utils.metakg.edge import EdgeAPI, MetaKGEdge
+from utils.metakg.parser import MetaKGParser
+
+dirname = os.path.dirname(__file__)
+
+with open(os.path.join(dirname, "mygene.es.json"), "r") as file:
+    MYGENE_ES = json.load(file)
+
+with open(os.path.join(dirname, "mychem.es.json"), "r") as file:
+    MYCHEM_ES = json.load(file)
+
+with open(os.path.join(dirname, "mygene.yml"), "rb") as file:
+    MYGENE_RAW = file.read()
+
+with open(os.path.join(dirname, "mychem.yml"), "rb") as file:
+    MYCHEM_RAW = file.read()
+
+MYGENE_ID = MYGENE_ES.pop("_id")
+MYCHEM_ID = MYCHEM_ES.pop("_id")
+
+MODEL_INDICES = {
+    MetaKGDoc: ES_INDICES["metakg"],
+    ConsolidatedMetaKGDoc: ES_INDICES["metakg_consolidated"],
+    MetaKGOperationDoc: METAKG_OPERATIONS_ES_INDEX,
+}
+
+# subject, predicate, object of the stubbed edges of each API
+TRIPLES = {
+    MYGENE_ID: [
+        ("Gene", "related_to", "Disease"),
+        ("Gene", "related_to", "Pathway"),
+        ("Gene", "interacts_with", "Gene"),
+    ],
+    MYCHEM_ID: [
+        ("SmallMolecule", "treats", "Disease"),
+        ("Gene", "related_to", "Disease"),  # also provided by mygene
+    ],
+}
+
+
+def stub_edges(api_id):
+    api = EdgeAPI(api_id, f"https://example.org/{api_id}.yml", api_id, ["translator"], None)
+    return [
+        MetaKGEdge(subject, object, predicate, api, bte={"query_operation": {"path": f"/{predicate}"}})
+        for subject, predicate, object in TRIPLES[api_id]
+    ]
+
+
+def stub_iter_metakg(self, include_trapi=True, url_cache=None):
+    self.metakg_errors = None
+    if include_trapi or not self.is_trapi:
+        yield from stub_edges(self._id)
+
+
+def delete_metakg_indices():
+    es = connections.get_connection()
+    for model_class in MODEL_INDICES:
+        for index in indices.get_generations(model_class):
+            es.indices.delete(index=index)
+        if indices.exists(model_class):
+            indices.delete(model_class)
+
+
+def count_edges(api_id=None):
+    search = MetaKGDoc.search()
+    if api_id:
+        search = search.filter("term", **{"api.smartapi.id": api_id})
+    return search.count()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_fixture():
+    """
+    Index 2 documents, and point the MetaKG models to their test indices.
+    """
+    SmartAPI.INDEX = ES_INDICES["metadata"]
+    indices.reset(SmartAPIDoc, index=SmartAPI.INDEX)
+    for _id, doc, raw in ((MYGENE_ID, MYGENE_ES, MYGENE_RAW), (MYCHEM_ID, MYCHEM_ES, MYCHEM_RAW)):
+        smartapi = SmartAPIDoc(meta={"id": _id}, **doc)
+        smartapi._raw = decoder.compress(raw)
+        smartapi.save(index=SmartAPI.INDEX)
+    indices.refresh(SmartAPIDoc, index=SmartAPI.INDEX)
+
+    with ExitStack() as stack:
+        for model_class, name in MODEL_INDICES.items():
+            stack.enter_context(mock.patch.object(model_class.Index, "name", name))
+            stack.enter_context(mock.patch.object(model_class._index, "_name", name))
+        stack.enter_context(mock.patch.object(SmartAPI, "is_trapi", property(lambda self: self._id == MYCHEM_ID)))
+        stack.enter_context(mock.patch.object(SmartAPI, "iter_metakg", stub_iter_metakg))
+        delete_metakg_indices()
+        yield
+        delete_metakg_indices()
+
+    indices.delete(SmartAPIDoc, index=SmartAPI.INDEX)
+    SmartAPI.INDEX = None
+
+
+def test_incremental_without_hashes():
+    """
+    An index built before API hashes were recorded is rebuilt in full, not duplicated.
+    """
+    delete_metakg_indices()
+    indices.setup(MetaKGDoc)
+    legacy_edges = (
+        {**MetaKGDoc(**edge.to_dict()).to_dict(include_meta=True), "_index": MetaKGDoc.Index.name}
+        for api_id in TRIPLES
+        for edge in stub_edges(api_id)
+    )
+    indices.bulk_index(legacy_edges)
+    indices.refresh(MetaKGDoc)
+    assert count_edges() == 5
+
+    with pytest.raises(ValueError):
+        SmartAPI.refresh_metakg(incremental=True)
+
+    admin.refresh_metakg(cache_dir=None, incremental=True)
+    assert indices.get_alias_indices(MetaKGDoc)  # a new generation
+    assert count_edges(MYGENE_ID) == 3
+    assert count_edges(MYCHEM_ID) == 2
+    assert indices.get_meta(MetaKGDoc)["api_hashes"].keys() == {MYGENE_ID, MYCHEM_ID}
+
+    # nothing changed since
+    admin.refresh_metakg(cache_dir=None, incremental=True)
+    indices.refresh(MetaKGDoc)
+    assert count_edges() == 5
+
+
+def test_incremental_without_trapi():
+    """
+    TRAPI edges and hashes are kept when TRAPI metakgs are not fetched.
+    """
+    delete_metakg_indices()
+    admin.refresh_metakg(cache_dir=None)
+    api_hashes = indices.get_meta(MetaKGDoc)["api_hashes"]
+    assert count_edges(MYCHEM_ID) == 2
+
+    SmartAPI.refresh_metakg(include_trapi=False, incremental=True)
+    indices.refresh(MetaKGDoc)
+    assert count_edges(MYGENE_ID) == 3
+    assert count_edges(MYCHEM_ID) == 2
+    assert indices.get_meta(MetaKGDoc)["api_hashes"] == api_hashes
+
+
+def test_switch_alias():
+    """
+    The alias is switched to each new generation, the previous live ones are kept.
+    """
+    delete_metakg_indices()
+    first = indices.create_generation(MetaKGDoc)
+    assert indices.switch_alias(MetaKGDoc, first, keep=1) == []
+    second = indices.create_generation(MetaKGDoc)
+    assert indices.switch_alias(MetaKGDoc, second, keep=1) == []
+    assert indices.get_alias_indices(MetaKGDoc) == [second]
+    assert indices.get_generations(MetaKGDoc) == [first, second]
+    assert indices.get_meta(MetaKGDoc)["previous_generation"] == first
+
+    # only keep generations are kept, besides the live one
+    third = indices.create_generation(MetaKGDoc)
+    assert indices.switch_alias(MetaKGDoc, third, keep=1) == [first]
+    assert indices.get_alias_indices(MetaKGDoc) == [third]
+    assert indices.get_generations(MetaKGDoc) == [second, third]
+
+
+def test_rollback():
+    """
+    A rollback points the alias back to the previous live generation.
+    """
+    delete_metakg_indices()
+    assert indices.rollback(MetaKGDoc) is None
+    first, second = indices.create_generation(MetaKGDoc), indices.create_generation(MetaKGDoc)
+    indices.switch_alias(MetaKGDoc, first)
+    # never live, so not a rollback target
+    indices.create_generation(MetaKGDoc)
+    indices.switch_alias(MetaKGDoc, second)
+
+    assert indices.rollback(MetaKGDoc) == first
+    assert indices.get_alias_indices(MetaKGDoc) == [first]
+    assert indices.rollback(MetaKGDoc) is None
+    assert indices.get_alias_indices(MetaKGDoc) == [first]
+
+
+def test_delete_generation():
+    """
+    The live generation cannot be deleted.
+    """
+    delete_metakg_indices()
+    first, second = indices.create_generation(MetaKGDoc), indices.create_generation(MetaKGDoc)
+    indices.switch_alias(MetaKGDoc, first)
+    with pytest.raises(ValueError):
+        indices.delete_generation(MetaKGDoc, first)
+    indices.delete_generation(MetaKGDoc, second)
+    assert indices.get_generations(MetaKGDoc) == [first]
+
+
+def test_failed_build():
+    """
+    A failed build is deleted, and the alias is left as is.
+    """
+    delete_metakg_indices()
+    admin.refresh_metakg(cache_dir=None)
+    live, generations = indices.get_alias_indices(MetaKGDoc), indices.get_generations(MetaKGDoc)
+
+    with mock.patch.object(SmartAPI, "iter_metakg", side_effect=RuntimeError("unreachable")):
+        with pytest.raises(RuntimeError):
+            admin.refresh_metakg(cache_dir=None)
+    with pytest.raises(RuntimeError):
+        with admin._new_generations(MetaKGDoc, ConsolidatedMetaKGDoc):
+            raise RuntimeError("failed build")
+
+    assert indices.get_alias_indices(MetaKGDoc) == live
+    assert indices.get_generations(MetaKGDoc) == generations
+    assert indices.get_generations(ConsolidatedMetaKGDoc) == []
+    assert count_edges() == 5
+
+
+def test_bulk_index():
+    """
+    Actions are sent in chunks of at most max_chunk_bytes, and the failed ones are counted.
+    """
+    delete_metakg_indices()
+    indices.setup(MetaKGDoc)
+    actions = [
+        {"_index": MetaKGDoc.Index.name, "_id": predicate, "_source": {"subject": "Gene", "predicate": predicate}}
+        for predicate in ("related_to", "interacts_with", "treats", "causes")
+    ]
+    # rejected by the mapping, "api" is an object
+    actions.append({"_index": MetaKGDoc.Index.name, "_id": "invalid", "_source": {"subject": "Gene", "api": "mygene"}})
+
+    with mock.patch.object(indices, "streaming_bulk", wraps=indices.streaming_bulk) as streaming_bulk:
+        stats = indices.bulk_index(actions, thread_count=2, chunk_size=10, max_chunk_bytes=1)
+    # no two actions fit in a chunk
+    assert streaming_bulk.call_count == 5
+    assert stats["docs"] == 4
+    assert stats["failed"] == 1
+    assert stats["bytes"] > 0
+    indices.refresh(MetaKGDoc)
+    assert count_edges() == 4
+
+    with pytest.raises(RuntimeError):
+        admin._check_bulk_stats({MetaKGDoc.Index.name: stats})
+    admin._check_bulk_stats({MetaKGDoc.Index.name: stats}, raise_error=False)
+
+
+def consolidate_in_memory(edges):
+    """
+    The consolidation before it was streamed from a sorted scan,
+    all the groups are built in memory, from the edges in any order.
+    """
+    groups = {}
+    for edge in edges:
+        key = f'{edge["subject"]}-{edge["predicate"]}-{edge["object"]}'
+        if key in groups:
+            if edge["api"] not in groups[key]["api"]:
+                groups[key]["api"].append(edge["api"])
+        else:
+            groups[key] = {
+                "_id": key,
+                "subject": edge["subject"],
+                "object": edge["object"],
+                "predicate": edge["predicate"],
+                "api": [edge["api"]],
+                **{k: edge[k] for k in ["subject_prefix", "object_prefix"] if k in edge},
+            }
+    return list(groups.values())
+
+
+def sorted_groups(groups):
+    """Consolidated edges in _id order, with their APIs in a canonical order."""
+    return sorted(
+        ({**group, "api": sorted(group["api"], key=json.dumps)} for group in groups), key=lambda group: group["_id"]
+    )
+
+
+def test_consolidation():
+    """
+    The groups streamed from the sorted scan are those built in memory,
+    also when predicates differ only by case, as predicates are sorted lowercased.
+    """
+    delete_metakg_indices()
+    indices.setup(MetaKGDoc)
+    edges = []
+    for subject, predicate, object in [
+        ("Gene", "related_to", "Disease"),
+        ("Gene", "Related_to", "Disease"),
+        ("Gene", "RELATED_TO", "Disease"),
+        ("Gene", "related_to", "Gene"),
+        ("gene", "related_to", "Disease"),
+        ("Gene", "interacts_with", "Disease"),
+        ("Gene", "Related_to", "Disease"),
+    ]:
+        for api_id in (MYGENE_ID, MYCHEM_ID, MYGENE_ID):  # including duplicated APIs
+            api = {"name": api_id, "smartapi": {"id": api_id}, "bte_ref": predicate}
+            edges.append({"subject": subject, "object": object, "predicate": predicate, "api": api})
+    indices.bulk_index(
+        {**MetaKGDoc(**edge).to_dict(include_meta=True), "_index": MetaKGDoc.Index.name} for edge in edges
+    )
+    indices.refresh(MetaKGDoc)
+
+    scanned = [hit["_source"] for hit in SmartAPI.get_all_via_scan(index=MetaKGDoc.Index.name)]
+    groups = list(SmartAPI.edge_consolidation_build())
+    assert len(groups) == 6
+    assert sorted_groups(groups) == sorted_groups(consolidate_in_memory(scanned))
+
+
+def get_consolidated_edges():
+    hits = SmartAPI.get_all_via_scan(index=ConsolidatedMetaKGDoc.Index.name)
+    return sorted_groups({**hit["_source"], "_id": hit["_id"]} for hit in hits)
+
+
+def test_refresh_and_consolidate():
+    """
+    The single pass build indexes the same consolidated edges as a refresh then a consolidation.
+    """
+    delete_metakg_indices()
+    admin.refresh_metakg(cache_dir=None)
+    admin.consolidate_metakg()
+    consolidated_edges = get_consolidated_edges()
+    assert len(consolidated_edges) == 4
+    assert [len(edge["api"]) for edge in consolidated_edges if edge["_id"] == "Gene-related_to-Disease"] == [2]
+
+    live = indices.get_alias_indices(MetaKGDoc), indices.get_alias_indices(ConsolidatedMetaKGDoc)
+    admin.refresh_and_consolidate_metakg(cache_dir=None)
+    assert indices.get_alias_indices(MetaKGDoc) != live[0]
+    assert indices.get_alias_indices(ConsolidatedMetaKGDoc) != live[1]
+    assert count_edges() == 5
+    assert get_consolidated_edges() == consolidated_edges
+
+
+class MetaKGHandler(BaseHTTPRequestHandler):
+    """A slow TRAPI /meta_knowledge_graph, recording how many requests it serves at once."""
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        time.sleep(0.2)
+        with self.server.lock:
+            self.server.active -= 1
+        body = json.dumps({"edges": [{"subject": "biolink:Gene", "object": "biolink:Disease"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def fetch_all_metakg(iter_metakgs, **options):
+    """Return the edges fetched from APIs stubbed by their iter_metakg functions."""
+    apis = []
+    for i, iter_metakg in enumerate(iter_metakgs):
+        api = mock.Mock(_id=f"api{i}", raw=b"{}", is_trapi=False, metakg_errors=None)
+        api.iter_metakg.side_effect = iter_metakg
+        apis.append(api)
+    with mock.patch.object(SmartAPI, "count", return_value=len(apis)):
+        with mock.patch.object(SmartAPI, "get_all", return_value=apis):
+            return list(SmartAPI.fetch_all_metakg(**options))
+
+
+def test_fetch_all_metakg():
+    """
+    APIs are fetched concurrently, and an error of one of them is raised.
+    """
+    barrier = threading.Barrier(4, timeout=5)
+
+    def iter_metakg(**kwargs):
+        barrier.wait()  # broken unless all the APIs are fetched at once
+        yield {"subject": "Gene", "object": "Disease"}
+
+    assert len(fetch_all_metakg([iter_metakg] * 4, max_workers=4)) == 4
+
+    def iter_metakg_error(**kwargs):
+        yield {"subject": "Gene", "object": "Disease"}
+        raise RuntimeError("unreachable")
+
+    with pytest.raises(RuntimeError):
+        fetch_all_metakg([iter_metakg_error] * 4, max_workers=2)
+
+
+def test_fetch_all_metakg_per_host():
+    """
+    Requests to the same TRAPI server are limited, whatever the number of workers.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MetaKGHandler)
+    server.lock, server.active, server.max_active = threading.Lock(), 0, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def iter_metakg(**kwargs):
+        parser = MetaKGParser()
+        parser.metakg_errors = {}
+        yield from parser.iter_url_edges(url)
+
+    try:
+        assert len(fetch_all_metakg([iter_metakg] * 6, max_workers=6)) == 6
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert server.max_active == MetaKGParser.max_requests_per_host
+
+
+def test_hydrate_bte_error():
+    """
+    An elasticsearch error during the bte hydration is mapped like one of the search.
+    """
+    backend = mock.Mock()
+    backend.execute = mock.AsyncMock()
+    backend.client.mget = mock.AsyncMock(side_effect=ConnectionError("unreachable"))
+    formatter = mock.Mock()
+    formatter.transform.return_value = {"hits": [{"api": {"name": "mygene", "bte_ref": "ref"}}]}
+    pipeline = MetaKGQueryPipeline(mock.Mock(), backend, formatter)
+
+    with pytest.raises(QueryPipelineException) as exc_info:
+        asyncio.run(pipeline.search("*", bte=True))
+    assert exc_info.value.code == 503
+    # without bte=1, no hydration is attempted
+    assert asyncio.run(pipeline.search("*"))["hits"][0]["api"]["bte_ref"] == "ref"
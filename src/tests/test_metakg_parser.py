@@ -0,0 +1,95 @@
+"""
+    MetaKG Parser Handler Tests
+
+    The SmartAPI documents to parse are served by the test application itself,
+    no Elasticsearch index is used.
+
+"""
+
+import json
+import os
+
+from biothings.web.launcher import BiothingsAPI
+from biothings.web.settings import configs
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import RequestHandler
+
+dirname = os.path.dirname(__file__)
+
+with open(os.path.join(dirname, "_utils", "metakg", "data", "mygene.json"), "r") as file:
+    MYGENE = json.load(file)
+
+with open(os.path.join(dirname, "_utils", "metakg", "data", "litvar.json"), "r") as file:
+    LITVAR = json.load(file)
+
+
+class DocumentHandler(RequestHandler):
+    def get(self, name):
+        if name != "mygene":
+            self.set_status(404)
+            return
+        self.write(MYGENE)
+
+
+class TestMetaKGBatchParser(AsyncHTTPTestCase):
+    def get_app(self):
+        app = BiothingsAPI.get_app(configs.load(os.path.join(dirname, os.environ["TEST_CONF"])))
+        app.add_handlers(r".*", [(r"/documents/(\w+)", DocumentHandler)])
+        return app
+
+    def post_batch(self, body, query="", headers=None):
+        response = self.fetch(
+            "/api/metakg/parse/batch" + query,
+            method="POST",
+            body=json.dumps(body),
+            headers={"Content-Type": "application/json"} if headers is None else headers,
+            raise_error=False,
+        )
+        return response.code, response.body.decode()
+
+    def batch_body(self):
+        return {
+            "urls": [self.get_url("/documents/mygene"), self.get_url("/documents/missing")],
+            "documents": [LITVAR, "not a document"],
+        }
+
+    def test_results(self):
+        code, body = self.post_batch(self.batch_body())
+        self.assertEqual(code, 200)
+        hits = json.loads(body)["hits"]
+        # one result per url, then per document, in the request order
+        self.assertEqual([hit["index"] for hit in hits], [0, 1, 2, 3])
+        self.assertEqual(hits[0]["url"], self.get_url("/documents/mygene"))
+        self.assertGreater(hits[0]["total"], 0)
+        self.assertEqual(hits[2]["total"], len(hits[2]["hits"]))
+        # errors are isolated in their own results
+        self.assertEqual(hits[1]["error"]["code"], 400)
+        self.assertEqual(hits[3]["error"]["code"], 400)
+        self.assertNotIn("error", hits[0])
+        self.assertNotIn("error", hits[2])
+
+    def test_same_as_single_parse(self):
+        code, body = self.post_batch({"documents": [LITVAR]})
+        response = self.fetch(
+            "/api/metakg/parse", method="POST", body=json.dumps(LITVAR), headers={"Content-Type": "application/json"}
+        )
+        self.assertEqual(json.loads(body)["hits"][0]["hits"], json.loads(response.body)["hits"])
+
+    def test_ndjson(self):
+        code, body = self.post_batch(self.batch_body(), query="?format=ndjson")
+        self.assertEqual(code, 200)
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(sorted(line["index"] for line in lines[:-1]), [0, 1, 2, 3])
+        # the last line summarizes the results
+        self.assertEqual(lines[-1], {"total": 4, "errors": 2})
+
+    def test_item_limit(self):
+        code, _ = self.post_batch({"documents": [LITVAR] * 101})
+        self.assertEqual(code, 400)
+        code, _ = self.post_batch({"urls": []})
+        self.assertEqual(code, 400)
+
+    def test_body_without_content_type(self):
+        code, body = self.post_batch({"documents": [LITVAR]}, headers={})
+        self.assertEqual(code, 200)
+        self.assertEqual(json.loads(body)["hits"][0]["total"], 1)
@@ -0,0 +1,126 @@
+"""
+    MetaKG Path Finder Handler Tests
+
+    Paths are found in a prebuilt graph, served in place of the shared
+    one, no Elasticsearch index is used.
+
+"""
+
+import json
+import os
+import threading
+from unittest import mock
+
+from biothings.web.launcher import BiothingsAPI
+from biothings.web.services.health import ESHealth
+from biothings.web.settings import configs
+from handlers.api import MetaKGPathFinderHandler
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import RequestHandler
+from utils.metakg.graph import MetaKGGraph, graph_store
+from utils.metakg.path_finder import MetaKGPathFinder
+
+dirname = os.path.dirname(__file__)
+
+EXPANDED_FIELDS = {"subject": ["Gene"], "object": ["Disease"]}
+
+
+def build_graph():
+    """Return a graph with 4 paths from Gene to Disease."""
+    graph = MetaKGGraph()
+    graph.add_edge("Gene", "Disease", "related_to", [{"name": "api1", "smartapi": {"id": "api1"}}])
+    for node in ["Protein", "Chemical", "Pathway"]:
+        graph.add_edge("Gene", node, "related_to", [{"name": "api1", "smartapi": {"id": "api1"}}])
+        graph.add_edge(node, "Disease", "related_to", [{"name": "api2", "smartapi": {"id": "api2"}}])
+    graph.freeze()
+    return graph
+
+
+class TestMetaKGPathFinder(AsyncHTTPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.graph = build_graph()
+        patcher = mock.patch.object(graph_store, "get", return_value=self.graph)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # the result cache is shared by all the requests of the process
+        MetaKGPathFinderHandler.cache = None
+
+    def get_app(self):
+        return BiothingsAPI.get_app(configs.load(os.path.join(dirname, os.environ["TEST_CONF"])))
+
+    def get_paths(self, query="", subject="Gene"):
+        response = self.fetch(f"/api/metakg/paths?subject={subject}&object=Disease&cutoff=2" + query, raise_error=False)
+        return response.code, response.body.decode()
+
+    def get_ndjson_paths(self, query=""):
+        code, body = self.get_paths("&format=ndjson" + query)
+        self.assertEqual(code, 200)
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_ndjson(self):
+        paths = MetaKGPathFinder(expanded_fields=EXPANDED_FIELDS, graph=self.graph).get_paths(cutoff=2)
+        with mock.patch.object(MetaKGPathFinderHandler, "stream_batch_size", 3):
+            with mock.patch.object(
+                MetaKGPathFinderHandler, "flush", autospec=True, side_effect=RequestHandler.flush
+            ) as flush:
+                lines = self.get_ndjson_paths()
+        # one path per line, as found
+        self.assertEqual(lines[:-1], paths)
+        # then the summary line
+        self.assertEqual(lines[-1], {"total": 4, "truncated": False})
+        # each batch of paths is flushed before the next one is enumerated
+        self.assertEqual(len([call for call in flush.call_args_list if not call.kwargs]), 2)
+
+    def test_ndjson_truncated(self):
+        lines = self.get_ndjson_paths("&max_paths=3")
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[-1], {"total": 3, "truncated": True})
+        lines = self.get_ndjson_paths("&size=2&from=1")
+        self.assertEqual(lines[-1], {"total": 2, "truncated": True})
+        lines = self.get_ndjson_paths("&size=2&from=2")
+        self.assertEqual(lines[-1], {"total": 2, "truncated": False})
+
+    def test_ndjson_missing_node(self):
+        code, _ = self.get_paths("&format=ndjson", subject="Protein2")
+        self.assertEqual(code, 400)
+
+    def test_paths(self):
+        paths = MetaKGPathFinder(expanded_fields=EXPANDED_FIELDS, graph=self.graph).get_paths(cutoff=2)
+        threads = []
+        _get_paths = MetaKGPathFinder.get_paths
+
+        def get_paths(pathfinder, **kwargs):
+            threads.append(threading.current_thread().name)
+            return _get_paths(pathfinder, **kwargs)
+
+        with mock.patch.object(MetaKGPathFinder, "get_paths", autospec=True, side_effect=get_paths):
+            code, body = self.get_paths()
+        self.assertEqual(code, 200)
+        self.assertEqual(json.loads(body), {"total": 4, "truncated": False, "paths": paths})
+        # found in the path finder thread pool, off the IOLoop
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith("metakg_pathfinder"))
+
+    def test_errors(self):
+        # reported by the path finder in the thread pool
+        code, body = self.get_paths(subject="Protein2")
+        self.assertEqual(code, 400)
+        self.assertIn("Subject node Protein2 is not found in the MetaKG", body)
+        # raised in the thread pool
+        graph_store.get.side_effect = RuntimeError("graph unavailable")
+        code, _ = self.get_paths()
+        self.assertEqual(code, 500)
+
+    def test_cache_status(self):
+        self.get_paths()
+        self.get_paths()
+        with mock.patch.object(ESHealth, "async_check", autospec=True, return_value={"status": "green"}):
+            response = self.fetch("/api/status?dev")
+        self.assertEqual(response.code, 200)
+        stats = json.loads(response.body)["metakg_pathfinder_cache"]
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+        # only the health check without dev
+        with mock.patch.object(ESHealth, "async_check", autospec=True, return_value={"status": "green"}):
+            response = self.fetch("/api/status")
+        self.assertNotIn("metakg_pathfinder_cache", json.loads(response.body))
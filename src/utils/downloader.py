@@ -12,6 +12,7 @@ import requests
 from tornado import httpclient
 
 from utils import decoder
+from utils.http_client import get_session
 
 # TODO should capture ERR_CONNECTION_TIMED_OUT message
 
@@ -124,7 +125,7 @@ def download(url, timeout=5, raise_error=True):
         headers = {
             'User-Agent': 'SmartAPI' # UA required by GitHub
         }
-        response = requests.get(url, headers=headers, timeout=timeout)
+        response = get_session().get(url, headers=headers, timeout=timeout)
         if raise_error:
             response.raise_for_status()
         result = RequestsParser(response)
@@ -157,7 +158,7 @@ def download_mapping(url):
     headers = {
         'User-Agent': 'SmartAPI' # UA required by GitHub
     }
-    response = requests.get(url, headers=headers, timeout=60)
+    response = get_session().get(url, headers=headers, timeout=60)
     response.raise_for_status()
 
     return decoder.to_dict(stream=response.content, ext=file_extension(url), ctype=response.headers.get("Content-Type"))
@@ -0,0 +1,177 @@
+"""
+Shared HTTP client
+
+    get_session() : the requests.Session shared by the downloader and the
+                    MetaKG parser, get_session("monitor", ...) the one of
+                    the API monitor. Connections are kept alive in a pool
+                    per host, so repeated requests to the same host skip
+                    the TCP and TLS handshakes.
+
+    Each host has at most POOL_MAXSIZE open connections, further requests
+    wait for one to be released. Host names are resolved once per
+    DNS_CACHE_TTL seconds, and failed connections are retried with an
+    exponential backoff, see create_session(). The sessions are shared by
+    unrelated callers and threads, so they neither store nor send cookies.
+
+"""
+import logging
+import socket
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("http_client")
+
+POOL_CONNECTIONS = 64  # hosts whose connection pool is kept
+POOL_MAXSIZE = 8  # connections per host, kept alive and open at once
+RETRIES = 3
+BACKOFF_FACTOR = 0.5  # wait 0.5s, 1s, 2s... between retries
+RETRY_STATUSES = (429, 502, 503, 504)
+DNS_CACHE_TTL = 300  # seconds
+
+
+class DNSCache:
+    """Resolved addresses of host names, kept for ttl seconds."""
+
+    def __init__(self, ttl=DNS_CACHE_TTL):
+        self.ttl = ttl
+        self._addresses = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """Return the IP addresses of host, resolved again once expired."""
+        key = (host, port)
+        with self._lock:
+            addresses, expires = self._addresses.get(key, (None, 0))
+        if addresses and expires > time.monotonic():
+            return addresses
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        # unique addresses, in resolution order
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self._addresses[key] = (addresses, time.monotonic() + self.ttl)
+        return addresses
+
+    def invalidate(self, host, port):
+        with self._lock:
+            self._addresses.pop((host, port), None)
+
+    def clear(self):
+        with self._lock:
+            self._addresses.clear()
+
+
+dns_cache = DNSCache()
+
+
+class _CachedDNSMixin:
+    # connect to the cached addresses of the host, the host name
+    # itself is still used for the Host header, SNI and certificates
+    def _new_conn(self):
+        dns_host = self._dns_host
+        try:
+            addresses = dns_cache.resolve(dns_host, self.port)
+        except OSError:
+            return super()._new_conn()  # let urllib3 report the resolution error
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except NewConnectionError:
+                    if i == len(addresses) - 1:
+                        # the addresses may be outdated
+                        dns_cache.invalidate(dns_host, self.port)
+                        raise
+        finally:
+            self._dns_host = dns_host
+
+
+class _CachedDNSHTTPConnection(_CachedDNSMixin, HTTPConnection):
+    pass
+
+
+class _CachedDNSHTTPSConnection(_CachedDNSMixin, HTTPSConnection):
+    pass
+
+
+class _CachedDNSHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CachedDNSHTTPConnection
+
+
+class _CachedDNSHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CachedDNSHTTPSConnection
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections resolve host names through dns_cache."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CachedDNSHTTPConnectionPool,
+            "https": _CachedDNSHTTPSConnectionPool,
+        }
+
+
+def create_session(
+    pool_connections=POOL_CONNECTIONS,
+    pool_maxsize=POOL_MAXSIZE,
+    retries=RETRIES,
+    backoff_factor=BACKOFF_FACTOR,
+    retry_statuses=RETRY_STATUSES,
+):
+    """
+    Return a requests.Session keeping up to pool_maxsize connections alive per host,
+    for up to pool_connections hosts. Requests beyond pool_maxsize to a host wait.
+
+    Connection errors, and for idempotent methods retry_statuses, are retried up to
+    retries times, waiting backoff_factor * 2 ** (retry - 1) seconds, or as long as a
+    Retry-After header says. The last response is returned as is. Read errors, e.g. a
+    read timeout, are raised at once, so a request never takes much longer than its timeout.
+    Cookies set by the responses are rejected.
+    """
+    retry = Retry(
+        total=retries,
+        read=False,
+        backoff_factor=backoff_factor,
+        status_forcelist=retry_statuses,
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+    adapter = PooledHTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=True,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(name="default", **options):
+    """
+    Return the shared session of name, created on first use with the
+    create_session() options. Later options of the same name are ignored.
+    """
+    session = _sessions.get(name)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = _sessions[name] = create_session(**options)
+    return session
@@ -1,6 +1,16 @@
-from elasticsearch_dsl import Index
+import json
+import logging
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from elasticsearch.helpers import streaming_bulk
+from elasticsearch_dsl import Index, connections
 from model import SmartAPIDoc
 
+logger = logging.getLogger("indices")
+
 
 def exists(model_class=SmartAPIDoc, index=None):
     return Index(index or model_class.Index.name).exists()
@@ -37,3 +47,225 @@ def reset(model_class=SmartAPIDoc, index=None):
 def refresh(model_class=SmartAPIDoc, index=None):
     idx = Index(index or model_class.Index.name)
     idx.refresh()
+
+
+def get_meta(model_class=SmartAPIDoc, index=None):
+    """
+    Return the custom "_meta" field of the index mapping.
+    Return an empty dict if no such field is set.
+    """
+    mapping = Index(index or model_class.Index.name).get_mapping()
+    for _index in mapping:
+        return dict(mapping[_index]["mappings"].get("_meta", {}))
+    return {}
+
+
+def update_meta(model_class=SmartAPIDoc, index=None, **meta):
+    """
+    Update the custom "_meta" field of the index mapping.
+    Used to record index-level information like a build version.
+    """
+    _meta = get_meta(model_class, index=index)
+    _meta.update(meta)
+    Index(index or model_class.Index.name).put_mapping(meta=_meta)
+
+
+# Blue/green builds
+#
+# A model class index name can be an alias to one of its timestamped
+# generations, e.g. smartapi_metakg_docs -> smartapi_metakg_docs-20240101000000000000.
+# A new generation is fully built before the alias is atomically switched to it,
+# so readers never see an empty or partially built index.
+
+
+def get_generations(model_class=SmartAPIDoc):
+    """Return the names of the generations of the index, oldest first."""
+    alias = model_class.Index.name
+    pattern = re.compile(re.escape(alias) + r"-\d+$")
+    es = connections.get_connection()
+    return sorted(index for index in es.indices.get(index=f"{alias}-*") if pattern.match(index))
+
+
+def get_alias_indices(model_class=SmartAPIDoc):
+    """Return the names of the indices behind the index alias, empty if it is not an alias."""
+    es = connections.get_connection()
+    alias = model_class.Index.name
+    if not es.indices.exists_alias(name=alias):
+        return []
+    return list(es.indices.get_alias(name=alias))
+
+
+def create_generation(model_class=SmartAPIDoc):
+    """Create and return the name of a new, empty generation of the index."""
+    index = f"{model_class.Index.name}-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')}"
+    setup(model_class, index=index)
+    return index
+
+
+def delete_generation(model_class=SmartAPIDoc, index=None):
+    """Delete a generation of the index, e.g. a failed build. Never delete the live one."""
+    if index in get_alias_indices(model_class):
+        raise ValueError(f"Cannot delete {index}, the index alias points to it.")
+    if exists(model_class, index=index):
+        delete(model_class, index=index)
+
+
+def switch_alias(model_class=SmartAPIDoc, index=None, keep=2):
+    """
+    Atomically point the index alias to the generation index, and delete
+    the older generations but the keep most recent previous live ones.
+    A concrete index named like the alias is replaced in the same operation.
+
+    The generation the alias pointed to before is recorded as "previous_generation"
+    in the "_meta" of the new one, so that rollback() and the cleanup follow the
+    generations that were actually live, not any older index.
+    Return the names of the deleted generations.
+    """
+    current = get_alias_indices(model_class)
+    if current and index not in current:
+        update_meta(model_class, index=index, previous_generation=current[0])
+    _update_alias(model_class, index)
+
+    deleted = []
+    if keep is not None:
+        live = set(_iter_previous_generations(model_class, index, keep))
+        for _index in get_generations(model_class):
+            if _index < index and _index not in live:
+                connections.get_connection().indices.delete(index=_index)
+                deleted.append(_index)
+    return deleted
+
+
+def _update_alias(model_class, index):
+    es = connections.get_connection()
+    alias = model_class.Index.name
+    actions = [{"remove": {"index": _index, "alias": alias}} for _index in get_alias_indices(model_class)]
+    if not actions and es.indices.exists(index=alias):
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": index, "alias": alias}})
+    es.indices.update_aliases(actions=actions)
+
+
+def _iter_previous_generations(model_class, index, limit):
+    """Yield at most limit generations that were live before index, most recent first."""
+    seen = {index}
+    for _ in range(limit):
+        index = get_meta(model_class, index=index).get("previous_generation")
+        if not index or index in seen or not exists(model_class, index=index):
+            return
+        seen.add(index)
+        yield index
+
+
+def rollback(model_class=SmartAPIDoc):
+    """
+    Point the index alias back to the generation it pointed to before the current one.
+    Return the name of that generation, or None if there is none.
+    """
+    current = get_alias_indices(model_class)
+    if not current:
+        return None
+    previous = next(_iter_previous_generations(model_class, current[0], 1), None)
+    if previous:
+        # the previous generation keeps its own history, for further rollbacks
+        _update_alias(model_class, previous)
+    return previous
+
+
+def bulk_index(
+    actions,
+    thread_count=4,
+    chunk_size=500,
+    max_chunk_bytes=10 * 1024 * 1024,
+    max_retries=5,
+    initial_backoff=2,
+    max_backoff=60,
+    name="bulk",
+):
+    """
+    Index the bulk actions in chunks of at most chunk_size actions and max_chunk_bytes,
+    sent by thread_count threads. Actions rejected with a 429 are retried up to max_retries
+    times, waiting initial_backoff seconds then twice as long each time, up to max_backoff.
+    Log and return the number of "docs", "bytes" and "failed" actions, and the throughput.
+    """
+    es = connections.get_connection()
+    serializer = es.transport.serializers.get_serializer("application/json")
+    stats = {"docs": 0, "bytes": 0, "failed": 0}
+
+    def _send(chunk):
+        failed = 0
+        for ok, item in streaming_bulk(
+            es,
+            chunk,
+            chunk_size=len(chunk),
+            max_chunk_bytes=max_chunk_bytes,
+            max_retries=max_retries,
+            initial_backoff=initial_backoff,
+            max_backoff=max_backoff,
+            raise_on_error=False,
+            raise_on_exception=False,
+            yield_ok=False,
+        ):
+            failed += 1
+            if failed <= 10:  # do not flood the logs
+                logger.error("[%s] Failed to index: %s", name, item)
+        return len(chunk), failed
+
+    def _chunks():
+        chunk, chunk_bytes = [], 0
+        for action in actions:
+            action, size = _serialize_source(action, serializer)
+            if chunk and (len(chunk) >= chunk_size or chunk_bytes + size > max_chunk_bytes):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(action)
+            chunk_bytes += size
+            stats["bytes"] += size
+        if chunk:
+            yield chunk
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=thread_count, thread_name_prefix=name) as executor:
+        # at most two chunks per thread are buffered
+        pending = set()
+        for chunk in _chunks():
+            if len(pending) >= thread_count * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _update_bulk_stats(stats, *future.result())
+            pending.add(executor.submit(_send, chunk))
+        for future in pending:
+            _update_bulk_stats(stats, *future.result())
+
+    elapsed = max(time.monotonic() - start, 1e-6)
+    stats["seconds"] = round(elapsed, 3)
+    stats["docs_per_second"] = round(stats["docs"] / elapsed, 1)
+    stats["bytes_per_second"] = round(stats["bytes"] / elapsed, 1)
+    logger.info(
+        "[%s] Indexed %s docs in %.1fs (%.1f docs/s, %.2f MB/s), %s failed",
+        name,
+        stats["docs"],
+        elapsed,
+        stats["docs_per_second"],
+        stats["bytes_per_second"] / 1024 / 1024,
+        stats["failed"],
+    )
+    return stats
+
+
+def _serialize_source(action, serializer):
+    """
+    Return the bulk action with its "_source" serialized to bytes, which streaming_bulk
+    sends as is instead of serializing it again, and the size of the action.
+    """
+    source = action.get("_source")
+    if isinstance(source, dict) and action.get("_op_type", "index") != "update":
+        source = serializer.dumps(source)
+        return {**action, "_source": source}, len(source)
+    # e.g. a delete action, without a source to send
+    return action, len(json.dumps(action, default=str))
+
+
+def _update_bulk_stats(stats, docs, failed):
+    stats["docs"] += docs - failed
+    stats["failed"] += failed
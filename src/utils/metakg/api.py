@@ -1,6 +1,7 @@
 import json
 import logging
 from copy import copy
+from functools import cached_property
 from typing import Union
 
 from model.smartapi import SmartAPIDoc
@@ -32,11 +33,19 @@ class API:
                 self._smartapi_doc = decoder.to_dict(content.raw)
         return self._smartapi_doc
 
-    @property
+    @cached_property
+    def api_meta(self):
+        """The API metadata without its operations, built once per document."""
+        return self.fetch_API_meta()
+
+    @cached_property
+    def operations(self):
+        """The operations of all the paths of the document, extracted once, on first access."""
+        return list(self.iter_operations())
+
+    @cached_property
     def metadata(self):
-        metadata = self.fetch_API_meta()
-        metadata["operations"] = self.fetch_all_opts()
-        return metadata
+        return {**self.api_meta, "operations": self.operations}
 
     @property
     def is_trapi(self):
@@ -83,8 +92,9 @@ class API:
             _server_url = _server_url[:-1]
         return _server_url
 
-    @property
+    @cached_property
     def components(self):
+        # one instance per document, it holds the resolved refs
         if "components" not in self.smartapi_doc:
             return None
         return Components(self.smartapi_doc["components"])
@@ -110,13 +120,13 @@ class API:
         }
 
     def fetch_all_opts(self):
-        ops = []
-        api_meta = self.fetch_API_meta()
+        return list(self.iter_operations())
+
+    def iter_operations(self):
+        """Yield the operations of all the paths of the document, as they are extracted."""
         if "paths" in self.smartapi_doc:
-            for path in self.smartapi_doc["paths"].keys():
-                ep = Endpoint(self.smartapi_doc["paths"][path], api_meta, path)
-                ops = [*ops, *ep.construct_endpoint_info()]
-        return ops
+            for path, path_item_object in self.smartapi_doc["paths"].items():
+                yield from Endpoint(path_item_object, self.api_meta, path).iter_endpoint_info()
 
     # methods for extracting metakg edges
     def extract_metakgedges(self, ops, extra_data=None):
@@ -164,7 +174,7 @@ class API:
         return metakg_edges
 
     def get_xbte_metaedges(self, extra_data=None):
-        mkg = self.extract_metakgedges(self.metadata["operations"], extra_data=extra_data)
+        mkg = self.extract_metakgedges(self.operations, extra_data=extra_data)
         no_nodes = len({x["subject"] for x in mkg} | {x["object"] for x in mkg})
         no_edges = len({x["predicate"] for x in mkg})
         logger.info("Done [%s nodes, %s edges]", no_nodes, no_edges)
@@ -189,8 +199,8 @@ class API:
         return metakg
 
     def get_ops_from_trapi(self):
-        if self.metadata.get("url"):
-            trapi_metakg_url = self.metadata["url"] + "/meta_knowledge_graph"
+        if self.api_meta.get("url"):
+            trapi_metakg_url = self.api_meta["url"] + "/meta_knowledge_graph"
             content = download(trapi_metakg_url, timeout=60)   # 60s timeout, as trapi endpoint can be slow
             if content.status == 200:
                 data = decoder.to_dict(content.raw)
@@ -208,21 +218,21 @@ class API:
                         "output_type": self.remove_bio_link_prefix(pred["object"]),
                         "output_id": response.get("nodes", {}).get(pred["object"], {}).get("id_prefixes"),
                         "predicate": self.remove_bio_link_prefix(pred["predicate"]),
-                        "api_name": self.metadata.get("title"),
-                        "smartapi": self.metadata.get("smartapi"),
-                        "x-translator": self.metadata.get("x-translator"),
+                        "api_name": self.api_meta.get("title"),
+                        "smartapi": self.api_meta.get("smartapi"),
+                        "x-translator": self.api_meta.get("x-translator"),
                     },
-                    "tags": [*self.metadata.get("tags"), "bte-trapi"],
+                    "tags": [*self.api_meta.get("tags"), "bte-trapi"],
                     "query_operation": {
                         "path": "/query",
                         "method": "post",
-                        "server": self.metadata.get("url"),
+                        "server": self.api_meta.get("url"),
                         "path_params": None,
                         "params": None,
                         "request_body": None,
                         "support_batch": True,
                         "input_separator": ",",
-                        "tags": [*self.metadata.get("tags"), "bte-trapi"],
+                        "tags": [*self.api_meta.get("tags"), "bte-trapi"],
                     },
                 }
             )
@@ -0,0 +1,68 @@
+"""
+Content-addressed storage of the BTE operation payloads of MetaKG edges
+
+    Many edges of an API share the same "api.bte" payload, e.g. every
+    input x output association of one x-bte-kgs-operation. When indexed,
+    the payload is replaced by its hash under "api.bte_ref", and stored
+    once in the MetaKGOperationDoc index. It is only hydrated back into
+    "api.bte" when bte=1 is requested.
+
+"""
+import hashlib
+import json
+
+BTE_REF = "bte_ref"
+
+
+def get_bte_ref(bte):
+    """Return the content hash of a bte payload."""
+    return hashlib.sha256(json.dumps(bte, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def dehydrate_edge(edge):
+    """
+    Replace the "api.bte" payload of a MetaKG edge, a dict or a MetaKGEdge, by its hash
+    in "api.bte_ref". Return the (bte_ref, bte) pair, or None if the edge has no payload.
+    """
+    if not isinstance(edge, dict):
+        return edge.dehydrate()
+    bte = edge.get("api", {}).pop("bte", None)
+    if not bte:
+        return None
+    bte_ref = get_bte_ref(bte)
+    edge["api"][BTE_REF] = bte_ref
+    return bte_ref, bte
+
+
+def get_bte_refs(apis):
+    """Return the set of bte references in the api dict, or list of api dicts."""
+    if isinstance(apis, dict):
+        apis = [apis]
+    return {api[BTE_REF] for api in apis if isinstance(api, dict) and api.get(BTE_REF)}
+
+
+def hydrate_apis(apis, operations):
+    """
+    Replace the "bte_ref" of the api dict, or list of api dicts, in place by
+    the "bte" payload it references in operations, a dict of bte_ref to bte.
+    """
+    if isinstance(apis, dict):
+        apis = [apis]
+    for api in apis:
+        if isinstance(api, dict) and BTE_REF in api:
+            bte_ref = api.pop(BTE_REF)
+            if bte_ref in operations:
+                api["bte"] = operations[bte_ref]
+
+
+def get_operations(bte_refs):
+    """Fetch the bte payloads of the references, return a dict of bte_ref to bte."""
+    from elasticsearch_dsl import connections
+
+    from model import MetaKGOperationDoc
+
+    if not bte_refs:
+        return {}
+    es = connections.get_connection()
+    response = es.mget(index=MetaKGOperationDoc.Index.name, ids=list(bte_refs))
+    return {doc["_id"]: doc["_source"]["bte"] for doc in response["docs"] if doc.get("found")}
@@ -3,6 +3,7 @@ class Components:
 
     def __init__(self, components):
         self.components = components
+        self._resolved = {}  # ref -> component, with its nested refs resolved
 
     def fetch(self, obj, key):
         if key in ["#", "components"]:
@@ -12,6 +13,44 @@ class Components:
         return None
 
     def fetch_component_by_ref(self, ref):
+        """
+        Return the component of a ref like "#/components/x-bte-response-mapping/name", or None.
+        The refs nested in the component are resolved too. Each ref is only resolved once,
+        later calls return the same object.
+        """
+        return self.resolve_ref(ref)
+
+    def resolve_ref(self, ref, _parents=()):
+        if ref in self._resolved:
+            return self._resolved[ref]
+        res = self.resolve_nested_refs(self.lookup_ref(ref), (*_parents, ref))
+        self._resolved[ref] = res
+        return res
+
+    def resolve_nested_refs(self, obj, _parents=()):
+        """
+        Return obj with its {"$ref": ...} values replaced by their components. Unknown and
+        circular refs are kept as is. Containers are only copied if a ref is replaced in them.
+        """
+        if isinstance(obj, dict):
+            ref = obj.get("$ref")
+            if isinstance(ref, str) and ref not in _parents:
+                res = self.resolve_ref(ref, _parents)
+                if res is not None:
+                    return res
+            items = {key: self.resolve_nested_refs(value, _parents) for key, value in obj.items()}
+            if any(items[key] is not value for key, value in obj.items()):
+                return items
+            return obj
+        if isinstance(obj, list):
+            items = [self.resolve_nested_refs(value, _parents) for value in obj]
+            if any(item is not value for item, value in zip(items, obj)):
+                return items
+            return obj
+        return obj
+
+    def lookup_ref(self, ref):
+        """Return the component at the path of ref, as is, or None."""
         if ref.startswith("#/components/"):
             if ref[-1] == "/":
                 ref = ref[0:-1]
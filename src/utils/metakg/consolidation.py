@@ -0,0 +1,61 @@
+import hashlib
+import json
+
+from .edge import MetaKGEdge
+
+
+class EdgeConsolidator:
+    """
+    Group MetaKG edges on their subject/predicate/object.
+
+    Each group is a consolidated edge document, with the APIs of all its
+    edges under "api". APIs are deduplicated by a hash of their content.
+
+    Edges can be dicts, i.e. the source of MetaKG documents, or MetaKGEdge
+    records. Records are kept as is until the groups are popped, so the
+    API metadata they share is not copied for every edge.
+    """
+
+    def __init__(self):
+        self._groups = {}
+        self._api_hashes = {}
+
+    def __len__(self):
+        return len(self._groups)
+
+    def add(self, edge):
+        """Add an edge to its group."""
+        # Set key which we group by: subject-predicate-object
+        if isinstance(edge, MetaKGEdge):
+            key = f"{edge.subject}-{edge.predicate}-{edge.object}"
+            edge_api, api_hash = edge, edge.api_key()
+        else:
+            key = f'{edge["subject"]}-{edge["predicate"]}-{edge["object"]}'
+            edge_api = edge["api"]
+            api_hash = hashlib.sha256(json.dumps(edge_api, sort_keys=True, default=str).encode()).digest()
+
+        # Add edge to its group, merging API details if the edge already exists
+        if key in self._groups:
+            if api_hash not in self._api_hashes[key]:
+                self._api_hashes[key].add(api_hash)
+                self._groups[key][1].append(edge_api)
+        else:
+            self._api_hashes[key] = {api_hash}
+            self._groups[key] = (edge, [edge_api])
+
+    def pop_groups(self):
+        """Yield the consolidated edges and empty the consolidator."""
+        groups = self._groups
+        self._groups, self._api_hashes = {}, {}
+        for key, (edge, apis) in groups.items():
+            if isinstance(edge, MetaKGEdge):
+                edge = edge.to_dict()
+                apis = [api.api_dict() for api in apis]
+            yield {
+                "_id": key,
+                "subject": edge["subject"],
+                "object": edge["object"],
+                "predicate": edge["predicate"],
+                "api": apis,
+                **{k: edge[k] for k in ["subject_prefix", "object_prefix"] if k in edge}
+            }
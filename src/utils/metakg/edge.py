@@ -0,0 +1,153 @@
+"""
+Compact MetaKG edge records
+
+    Millions of MetaKG edges go through the parser, the indexer and the
+    consolidation, but they only vary by a few fields. An edge is held
+    as a MetaKGEdge with __slots__, its subject, object, predicate and
+    prefixes are interned, and the metadata of its API is an EdgeAPI
+    shared by all the edges of that API.
+
+    Edges are converted to dicts with to_dict() only when they leave
+    the pipeline, e.g. to be indexed or returned in a response.
+
+"""
+import json
+import sys
+
+from .bte import BTE_REF, get_bte_ref
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _hashable(value):
+    """Return a hashable equivalent of a JSON value, dicts and lists become tuples."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    return value
+
+
+class EdgeAPI:
+    """
+    The metadata of an API, shared by its edges. It is hashable and compared by content,
+    and must not be modified once created.
+    """
+
+    __slots__ = ("name", "metadata", "id", "tags", "x_translator", "_key")
+
+    def __init__(self, name, metadata, id, tags, x_translator):
+        self.name = name
+        self.metadata = metadata  # url of the SmartAPI document
+        self.id = id
+        self.tags = tuple(tags or ())
+        self.x_translator = x_translator
+        self._key = (name, metadata, id, self.tags, json.dumps(x_translator, sort_keys=True, default=str))
+
+    def __eq__(self, other):
+        return isinstance(other, EdgeAPI) and self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def to_dict(self):
+        x_translator = self.x_translator
+        if isinstance(x_translator, dict):
+            # a copy, so that the shared object is not modified through the result
+            x_translator = {k: list(v) if isinstance(v, list) else v for k, v in x_translator.items()}
+        return {
+            "name": self.name,
+            "smartapi": {
+                "metadata": self.metadata,
+                "id": self.id,
+                "ui": f"https://smart-api.info/ui/{self.id}",
+            },
+            "tags": list(self.tags),
+            "x-translator": x_translator,
+        }
+
+
+class EdgeAPICache:
+    """Return one shared EdgeAPI, and one shared tuple of prefixes, per distinct value."""
+
+    def __init__(self):
+        self._apis = {}
+        self._prefixes = {}
+        # consecutive edges mostly have equal x-translator dicts, even when they are
+        # distinct objects, e.g. read back from a cache, their key is only built once
+        self._x_translator = self._x_translator_key = None
+
+    def get_api(self, name, metadata, id, tags, x_translator):
+        if x_translator is not self._x_translator and x_translator != self._x_translator:
+            self._x_translator, self._x_translator_key = x_translator, _hashable(x_translator)
+        key = (name, metadata, id, tuple(tags or ()), self._x_translator_key)
+        api = self._apis.get(key)
+        if api is None:
+            api = self._apis[key] = EdgeAPI(name, metadata, id, tags, x_translator)
+        return api
+
+    def get_prefixes(self, prefixes):
+        if isinstance(prefixes, list):
+            key = tuple(_intern(prefix) for prefix in prefixes)
+            return self._prefixes.setdefault(key, key)
+        return _intern(prefixes)
+
+
+class MetaKGEdge:
+    """A MetaKG edge, see to_dict() for the document it stands for."""
+
+    __slots__ = (
+        "subject", "object", "predicate", "subject_prefix", "object_prefix", "api", "provided_by", "bte", "bte_ref"
+    )
+
+    def __init__(
+        self, subject, object, predicate, api, subject_prefix=None, object_prefix=None, provided_by=None, bte=None
+    ):
+        self.subject = _intern(subject)
+        self.object = _intern(object)
+        self.predicate = _intern(predicate)
+        self.api = api  # EdgeAPI
+        self.subject_prefix = subject_prefix  # None if not provided
+        self.object_prefix = object_prefix
+        self.provided_by = _intern(provided_by)
+        self.bte = bte or None
+        self.bte_ref = None
+
+    def dehydrate(self):
+        """
+        Replace the bte payload by its hash in bte_ref, see utils.metakg.bte.dehydrate_edge.
+        Return the (bte_ref, bte) pair, or None if the edge has no payload.
+        """
+        if not self.bte:
+            return None
+        bte, self.bte = self.bte, None
+        self.bte_ref = get_bte_ref(bte)
+        return self.bte_ref, bte
+
+    def api_key(self):
+        """Return a hashable key of the api details of the edge, see api_dict()."""
+        bte_hash = get_bte_ref(self.bte) if self.bte else None
+        return self.api, self.provided_by, bte_hash, self.bte_ref
+
+    def api_dict(self):
+        api = self.api.to_dict()
+        api["provided_by"] = self.provided_by
+        if self.bte:
+            api["bte"] = self.bte
+        if self.bte_ref:
+            api[BTE_REF] = self.bte_ref
+        return api
+
+    def to_dict(self):
+        edge = {
+            "subject": self.subject,
+            "object": self.object,
+            "predicate": self.predicate,
+            "api": self.api_dict(),
+        }
+        for key, prefix in (("subject_prefix", self.subject_prefix), ("object_prefix", self.object_prefix)):
+            if prefix is not None:
+                edge[key] = list(prefix) if isinstance(prefix, tuple) else prefix
+        return edge
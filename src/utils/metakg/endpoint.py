@@ -99,7 +99,10 @@ class Endpoint:
         return res
 
     def construct_endpoint_info(self):
-        res = []
+        return list(self.iter_endpoint_info())
+
+    def iter_endpoint_info(self):
+        """Yield the operations of the x-bte-kgs-operations of each method of the path."""
         for method in ["get", "post"]:
             if method in self.path_item_object:
                 path_params = self.fetch_path_params(self.path_item_object[method])
@@ -112,8 +115,4 @@ class Endpoint:
                         for op in operation:
                             if not isinstance(op, dict):
                                 continue
-                            res = [
-                                *res,
-                                *self.parse_individual_operation(op, method, path_params),
-                            ]
-        return res
+                            yield from self.parse_individual_operation(op, method, path_params)
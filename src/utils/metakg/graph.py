@@ -0,0 +1,445 @@
+"""
+    In-memory MetaKG graph used by the path finder (/api/metakg/paths)
+
+    The graph is built from the consolidated MetaKG index once per process,
+    kept in a shared store and reused by every path query until a newer
+    build of the consolidated index is detected.
+
+        from utils.metakg.graph import graph_store
+
+        graph = graph_store.get()  # build on first use, reuse afterwards
+        graph_store.reload()       # rebuild and swap, after consolidation
+
+"""
+import logging
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+from model import ConsolidatedMetaKGDoc
+from utils import indices
+
+logger = logging.getLogger("metakg_graph")
+
+# the only consolidated edge fields needed by the path finder
+GRAPH_SOURCE_FIELDS = ["subject", "object", "predicate", "api"]
+
+
+class MetaKGGraph:
+    """
+    A read-only snapshot of the consolidated MetaKG, stored as a compact
+    integer-indexed graph in compressed sparse row (CSR) format.
+
+    Node and predicate names are interned to integer ids. For node i, its
+    adjacency slots are indptr[i]:indptr[i + 1], each slot k being one
+    distinct subject -> object edge with target node indices[k]. The
+    predicates of slot k are edge_indptr[k]:edge_indptr[k + 1] in the
+    parallel edge_predicates (predicate ids) and edge_apis (api lists).
+
+    The reverse adjacency of node i is rev_indptr[i]:rev_indptr[i + 1] in
+    rev_indices (predecessor ids) and rev_slots (the forward slot ids).
+    predicate_slots[p] lists the slots with predicate id p, in slot order.
+    reachability[k - 1][i] is a bitset of the node ids reachable from node i
+    in at most k edges, for k up to reachability_max_hops.
+
+    Edges are added with add_edge() and the arrays are built by freeze().
+    Adjacency slots keep the order in which edges were first added.
+    version: the consolidated index build version this graph was built from
+    """
+
+    bidirectional_min_cutoff = 3
+    reachability_max_hops = 5  # the maximum cutoff of /api/metakg/paths
+
+    def __init__(self, version=None):
+        self.version = version
+        self.nodes = []  # node id -> name
+        self.node_ids = {}  # name -> node id
+        self.predicate_names = []  # predicate id -> name
+        self.predicate_ids = {}  # name -> predicate id
+        self.indptr = array("l", [0])
+        self.indices = array("l")
+        self.edge_indptr = array("l", [0])
+        self.edge_predicates = array("l")
+        self.edge_apis = []
+        self.rev_indptr = array("l", [0])
+        self.rev_indices = array("l")
+        self.rev_slots = array("l")
+        self.predicate_slots = []
+        self.reachability = []
+        self._pending = {}  # subject id -> {object id: [(predicate id, api), ...]}
+
+    def __contains__(self, name):
+        return name in self.node_ids
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _intern(self, name, names, ids):
+        _id = ids.get(name)
+        if _id is None:
+            _id = ids[sys.intern(name)] = len(names)
+            names.append(name)
+        return _id
+
+    def add_edge(self, subject, object, predicate, api):
+        subject_id = self._intern(subject, self.nodes, self.node_ids)
+        object_id = self._intern(object, self.nodes, self.node_ids)
+        predicate_id = self._intern(predicate, self.predicate_names, self.predicate_ids)
+        adjacency = self._pending.setdefault(subject_id, {})
+        adjacency.setdefault(object_id, []).append((predicate_id, api))
+
+    def freeze(self):
+        """Build the CSR arrays from the added edges and release the pending ones."""
+        pending, self._pending = self._pending, {}
+        indptr, indices = array("l", [0]), array("l")
+        edge_indptr, edge_predicates, edge_apis = array("l", [0]), array("l"), []
+        for node_id in range(len(self.nodes)):
+            for object_id, edges in pending.pop(node_id, {}).items():
+                indices.append(object_id)
+                for predicate_id, api in edges:
+                    edge_predicates.append(predicate_id)
+                    edge_apis.append(api)
+                edge_indptr.append(len(edge_predicates))
+            indptr.append(len(indices))
+        self.indptr, self.indices = indptr, indices
+        self.edge_indptr, self.edge_predicates, self.edge_apis = edge_indptr, edge_predicates, edge_apis
+        self._build_reverse()
+        self._build_predicate_index()
+        self._build_reachability()
+        return self
+
+    def _build_predicate_index(self):
+        predicate_slots = [array("l") for _ in self.predicate_names]
+        for slot in range(len(self.indices)):
+            for k in range(self.edge_indptr[slot], self.edge_indptr[slot + 1]):
+                slots = predicate_slots[self.edge_predicates[k]]
+                if not slots or slots[-1] != slot:
+                    slots.append(slot)
+        self.predicate_slots = predicate_slots
+
+    def _build_reverse(self):
+        # counting sort of the forward slots by their target node
+        num_nodes, num_slots = len(self.nodes), len(self.indices)
+        rev_indptr = array("l", [0]) * (num_nodes + 1)
+        for target in self.indices:
+            rev_indptr[target + 1] += 1
+        for node_id in range(num_nodes):
+            rev_indptr[node_id + 1] += rev_indptr[node_id]
+        fill = array("l", rev_indptr[:-1])
+        rev_indices, rev_slots = array("l", [0]) * num_slots, array("l", [0]) * num_slots
+        for node_id in range(num_nodes):
+            for slot in self.slots(node_id):
+                position = fill[self.indices[slot]]
+                rev_indices[position], rev_slots[position] = node_id, slot
+                fill[self.indices[slot]] += 1
+        self.rev_indptr, self.rev_indices, self.rev_slots = rev_indptr, rev_indices, rev_slots
+
+    def _build_reachability(self):
+        # nodes reachable in k edges are the successors and
+        # the nodes reachable from them in k - 1 edges
+        num_nodes = len(self.nodes)
+        one_hop = [_to_bitset(self.indices[slot] for slot in self.slots(node_id)) for node_id in range(num_nodes)]
+        reachability = [one_hop]
+        for _ in range(1, self.reachability_max_hops):
+            previous, current = reachability[-1], []
+            for node_id in range(num_nodes):
+                bits = one_hop[node_id]
+                for slot in self.slots(node_id):
+                    bits |= previous[self.indices[slot]]
+                current.append(bits)
+            reachability.append(current)
+        self.reachability = reachability
+
+    def reachable(self, node_id, hops):
+        """
+        Return the bitset of node ids reachable from node_id in at most hops edges.
+        Beyond reachability_max_hops, all the bits are set, as any node may be reachable.
+        """
+        if hops < 1:
+            return 0
+        if hops > self.reachability_max_hops:
+            return -1
+        return self.reachability[hops - 1][node_id]
+
+    def has_path(self, sources, targets, cutoff):
+        """
+        Return True if a path of at most cutoff edges exists from any
+        source to any target node id. Predicates are not considered.
+        """
+        target_bits = _to_bitset(targets)
+        return any(self.reachable(source, cutoff) & target_bits for source in sources)
+
+    def node_id(self, name):
+        return self.node_ids.get(name)
+
+    def slots(self, node_id):
+        """Return the range of adjacency slots of a node."""
+        return range(self.indptr[node_id], self.indptr[node_id + 1])
+
+    def edge_data(self, slot):
+        """Yield (predicate name, api list) for each predicate of an adjacency slot."""
+        for k in range(self.edge_indptr[slot], self.edge_indptr[slot + 1]):
+            yield self.predicate_names[self.edge_predicates[k]], self.edge_apis[k]
+
+    def _get_adjacency(self, predicates=None):
+        """
+        Return the successors and predecessors functions used for traversal.
+        successors(node id) gives its forward slots in order, predecessors(node id)
+        gives its (predecessor id, forward slot) pairs. If predicate ids are given,
+        only the slots with at least one of these predicates are included, and
+        the adjacency is built from the predicate index of these predicates only.
+        """
+        if predicates is None:
+            indptr, rev_indptr = self.indptr, self.rev_indptr
+            rev_indices, rev_slots = self.rev_indices, self.rev_slots
+
+            def successors(node_id):
+                return range(indptr[node_id], indptr[node_id + 1])
+
+            def predecessors(node_id):
+                start, end = rev_indptr[node_id], rev_indptr[node_id + 1]
+                return zip(rev_indices[start:end], rev_slots[start:end])
+
+            return successors, predecessors
+
+        forward, backward = {}, {}
+        for slot in sorted({slot for predicate in predicates for slot in self.predicate_slots[predicate]}):
+            source = bisect_right(self.indptr, slot) - 1
+            forward.setdefault(source, []).append(slot)
+            backward.setdefault(self.indices[slot], []).append((source, slot))
+        return (lambda node_id: forward.get(node_id, ())), (lambda node_id: backward.get(node_id, ()))
+
+    def iter_paths(self, sources, targets, cutoff, bidirectional=None, predicates=None):
+        """
+        Yield all simple paths from any of the sources to any of the targets
+        node ids with at most cutoff edges, as (node ids, slots) tuples.
+        If predicate ids are given, only the edges with at least one of these
+        predicates are followed.
+
+        All targets are searched in a single traversal from each source, in
+        depth-first order. A path to a target may go through another target.
+
+        With bidirectional enumeration the same paths are yielded in the same
+        order, but the search grows from both ends and joins at the middle.
+        The backward search from the targets is shared by all the sources.
+        By default it is used for cutoff >= bidirectional_min_cutoff.
+
+        The reachability index prunes the sources, targets and intermediate
+        nodes from which no target can be reached within the cutoff.
+        """
+        target_bits = _to_bitset(targets)
+        sources = [source for source in dict.fromkeys(sources) if self.reachable(source, cutoff) & target_bits]
+        source_bits = 0
+        for source in sources:
+            source_bits |= self.reachable(source, cutoff)
+        targets = {target for target in targets if source_bits >> target & 1}
+        if cutoff < 1 or not sources or not targets:
+            return
+        if bidirectional is None:
+            bidirectional = cutoff >= self.bidirectional_min_cutoff
+        successors, predecessors = self._get_adjacency(predicates)
+        suffixes = None
+        depth = cutoff
+        if bidirectional and cutoff > 1:
+            # every path is split at its node of depth ceil(cutoff / 2), or
+            # at its target if shorter: the prefixes come from a forward search,
+            # the suffixes from a backward search of depth cutoff - forward.
+            depth = (cutoff + 1) // 2
+            # with a single source, no suffix can go through it
+            exclude = set(sources) if len(sources) == 1 else set()
+            suffixes = self._get_suffixes(predecessors, targets, cutoff - depth, exclude)
+        for source in sources:
+            yield from self._search(successors, source, targets, cutoff, depth, suffixes)
+
+    def _search(self, successors, source, targets, cutoff, depth, suffixes=None):
+        """
+        Depth-first search from source up to depth edges, yielding the paths
+        to targets, and the joined suffix paths of the nodes at depth edges.
+        Nodes which cannot reach a target within cutoff edges are not expanded.
+        """
+        indices = self.indices
+        target_bits = _to_bitset(targets)
+        extend_targets = len(targets) > 1
+        nodes, path_slots = [source], []
+        visited = {source}
+        stack = [iter(successors(source))]
+        while stack:
+            slot = next(stack[-1], None)
+            if slot is None:
+                stack.pop()
+                visited.discard(nodes.pop())
+                if path_slots:
+                    path_slots.pop()
+                continue
+            child = indices[slot]
+            if child in visited:
+                continue
+            if child in targets:
+                yield (*nodes, child), (*path_slots, slot)
+                if not extend_targets:
+                    continue
+            if len(nodes) < depth:
+                if not self.reachable(child, cutoff - len(nodes)) & target_bits:
+                    continue
+                nodes.append(child)
+                path_slots.append(slot)
+                visited.add(child)
+                stack.append(iter(successors(child)))
+            elif suffixes is not None:
+                for suffix_nodes, suffix_slots in suffixes.get(child, ()):
+                    if visited.isdisjoint(suffix_nodes):
+                        yield (*nodes, child, *suffix_nodes), (*path_slots, slot, *suffix_slots)
+
+    def _get_suffixes(self, predecessors, targets, depth, exclude=()):
+        """
+        Search backwards from the targets up to depth edges, and map every node
+        reached to its simple paths towards the targets, as (node ids, slots)
+        tuples excluding the node itself, sorted in depth-first order.
+        Paths through the exclude node ids are skipped.
+        """
+        suffixes = {}
+        for target in targets:
+            if target in exclude:
+                continue
+            nodes, path_slots = [target], []
+            visited = {target, *exclude}
+            stack = [iter(predecessors(target))]
+            while stack:
+                parent, slot = next(stack[-1], (None, None))
+                if parent is None:
+                    stack.pop()
+                    if path_slots:
+                        visited.discard(nodes.pop())
+                        path_slots.pop()
+                    continue
+                if parent in visited:
+                    continue
+                suffix = (tuple(reversed(nodes)), (slot, *reversed(path_slots)))
+                suffixes.setdefault(parent, []).append(suffix)
+                if len(nodes) < depth:
+                    nodes.append(parent)
+                    path_slots.append(slot)
+                    visited.add(parent)
+                    stack.append(iter(predecessors(parent)))
+        for paths in suffixes.values():
+            # slot ids increase along each adjacency, so the
+            # lexicographic order of slots is the depth-first order
+            paths.sort(key=lambda suffix: suffix[1])
+        return suffixes
+
+    @classmethod
+    def build(cls, query_data=None, version=None):
+        """
+        Construct the graph from the documents in the metakg consolidated index.
+        Only the fields listed in GRAPH_SOURCE_FIELDS are retrieved from ES.
+        query_data can optionally filter which documents to use, e.g. {"q": "api.name:BTE"}.
+        """
+        from controller.metakg import MetaKG
+
+        graph = cls(version=version)
+        index = ConsolidatedMetaKGDoc.Index.name
+        query_data = {**(query_data or {}), "_source": GRAPH_SOURCE_FIELDS}
+
+        for doc in MetaKG.get_all_via_scan(size=1000, query_data=query_data, index=index):
+            graph.add_edge(
+                doc["_source"]["subject"],
+                doc["_source"]["object"],
+                doc["_source"]["predicate"],
+                doc["_source"]["api"],
+            )
+        return graph.freeze()
+
+
+def _to_bitset(node_ids):
+    bits = 0
+    for node_id in node_ids:
+        bits |= 1 << node_id
+    return bits
+
+
+def get_build_version():
+    """Return the build version stamped on the consolidated index, or None."""
+    return indices.get_meta(ConsolidatedMetaKGDoc).get("build_version")
+
+
+class MetaKGGraphStore:
+    """
+    Process-wide holder of the latest MetaKGGraph.
+
+    The consolidated index build version is checked at most once every
+    check_interval seconds. A new graph is always fully built before it
+    replaces the current one, so readers never observe a partial graph.
+    While a single thread checks the version and rebuilds the graph, the
+    other threads keep using the current one, they only wait for the
+    first graph of the process.
+    """
+
+    check_interval = 60  # seconds
+
+    def __init__(self):
+        self._graph = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, graph):
+        return graph is not None and time.monotonic() - self._checked_at < self.check_interval
+
+    def get(self):
+        """Return the shared graph, building or rebuilding it if necessary."""
+        graph = self._graph
+        if self._is_fresh(graph):
+            return graph
+
+        if graph is not None:
+            # another thread is already checking or rebuilding, keep the current graph
+            if not self._lock.acquire(blocking=False):
+                return graph
+            try:
+                return self._update()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to update the MetaKG graph, keeping version %s", graph.version)
+                self._checked_at = time.monotonic()
+                return graph
+            finally:
+                self._lock.release()
+
+        # no graph yet, only one thread builds, the others wait and reuse its result
+        with self._lock:
+            graph = self._graph
+            if self._is_fresh(graph):
+                return graph
+            return self._update()
+
+    def _update(self):
+        """Rebuild the graph if the build version changed, must be called with the lock held."""
+        graph = self._graph
+        version = get_build_version()
+        if graph is None or graph.version != version:
+            logger.info("Building MetaKG graph [version %s]", version)
+            graph = MetaKGGraph.build(version=version)
+            self._graph = graph
+        self._checked_at = time.monotonic()
+        return graph
+
+    def reload(self, force=False):
+        """
+        Rebuild the graph from the latest consolidated index and swap it in.
+        Does nothing if no graph is loaded in this process, unless forced.
+        """
+        if self._graph is None and not force:
+            return
+        with self._lock:
+            version = get_build_version()
+            logger.info("Reloading MetaKG graph [version %s]", version)
+            self._graph = MetaKGGraph.build(version=version)
+            self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        """Drop the current graph, the next get() call builds a new one."""
+        with self._lock:
+            self._graph = None
+
+
+graph_store = MetaKGGraphStore()
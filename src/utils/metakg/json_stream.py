@@ -0,0 +1,104 @@
+"""
+Incremental parsing of large JSON documents
+
+    iter_json_array() : yield the items of one array of a JSON object,
+                        read from an iterable of byte chunks
+
+"""
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _Buffer:
+    """Decoded text read from byte chunks on demand, consumed from the left."""
+
+    def __init__(self, chunks, min_read=65536):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+        self.min_read = min_read
+
+    def read_more(self, size=0):
+        """Append at least size more characters if available, return False at the end of the input."""
+        if self.pos > self.min_read:
+            # drop the consumed text, to keep the buffer small
+            self.text, self.pos = self.text[self.pos:], 0
+        target = len(self.text) + max(size, 1)
+        while len(self.text) < target and not self.eof:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+                self.text += self.utf8.decode(b"", final=True)
+            else:
+                self.text += self.utf8.decode(chunk)
+        return len(self.text) >= target or not self.eof
+
+    def peek(self):
+        """Return the next non-whitespace character, without consuming it, or "" at the end."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read_more():
+                return ""
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expecting one of {chars!r} at character {self.pos}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def decode_value(self):
+        """Decode and consume the next JSON value, reading more input until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                value, end = None, None
+            # a number could be cut at the end of the buffer, only trust it if followed by more text
+            if end is not None and (end < len(self.text) or self.eof):
+                self.pos = end
+                return value
+            if self.eof:
+                raise ValueError(f"Invalid or truncated JSON value at character {self.pos}")
+            # read as much again as the pending text, so that large values
+            # are decoded in a logarithmic number of attempts
+            self.read_more(len(self.text) - self.pos)
+
+
+def iter_json_array(chunks, key):
+    """
+    Yield the items of the array under key of the JSON object read from chunks of bytes, e.g.
+    a response body. Only one item is decoded at a time, the other values of the object are
+    decoded and discarded. Raise a ValueError if the document is not a valid JSON object.
+    """
+    buffer = _Buffer(chunks)
+    buffer.expect("{")
+    if buffer.peek() == "}":
+        return
+    while True:
+        name = buffer.decode_value()
+        if not isinstance(name, str):
+            raise ValueError(f"Expecting a property name at character {buffer.pos}")
+        buffer.expect(":")
+        if name == key and buffer.peek() == "[":
+            buffer.expect("[")
+            if buffer.peek() == "]":
+                buffer.expect("]")
+            else:
+                while True:
+                    yield buffer.decode_value()
+                    if buffer.expect(",]") == "]":
+                        break
+        else:
+            buffer.decode_value()
+        if buffer.expect(",}") == "}":
+            return
@@ -1,18 +1,57 @@
+import asyncio
+import hashlib
 import json
 import logging
+import tempfile
+import threading
 from copy import copy
-from typing import Dict, List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Union
+from urllib.parse import urlparse
 
+import certifi
 import requests
+from tornado.httpclient import AsyncHTTPClient
+from tornado.ioloop import IOLoop
+from tornado.simple_httpclient import HTTPTimeoutError
+
+from utils import decoder
+from utils.downloader import download_async
+from utils.http_client import get_session
 
 from .api import API
+from .edge import EdgeAPICache, MetaKGEdge
+from .json_stream import iter_json_array
+from .url_cache import MetaKGURLCache
 
 logger = logging.getLogger("metakg_parser")
 
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def get_host_semaphore(url, limit):
+    """Return the semaphore shared by all threads requesting the host of url."""
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(limit)
+        return _host_semaphores[host]
+
+
+async def acquire_host_semaphore(url, limit, interval=0.1):
+    """Acquire and return the semaphore of get_host_semaphore, without blocking the IOLoop."""
+    semaphore = get_host_semaphore(url, limit)
+    while not semaphore.acquire(blocking=False):
+        await asyncio.sleep(interval)
+    return semaphore
+
 
 class MetaKGParser:
     get_url_timeout = 60
+    max_requests_per_host = 2  # concurrent requests to the same TRAPI server, across threads
     metakg_errors = None
+    url_cache = None  # optional MetaKGURLCache, for conditional requests of TRAPI metakgs
+    url_validators = None  # validators of the last response from iter_url_edges
 
     def get_metakg(self,
                    data: Optional[Union[Dict, API]] = None,
@@ -36,37 +75,146 @@ class MetaKGParser:
         else:
             return self.get_non_TRAPI_metadatas(data=_api, extra_data=extra_data)
 
+    async def get_metakg_async(self,
+                               data: Optional[Union[Dict, API]] = None,
+                               extra_data: Optional[Dict] = None,
+                               url: Optional[str] = None,
+                               executor=None) -> List[Dict]:
+        """
+        Same as get_metakg, without blocking the IOLoop. The document at url and the TRAPI
+        metakgs are downloaded asynchronously, and the documents and responses are parsed
+        in executor, or in the default executor of the IOLoop.
+        """
+        if not data and not url:
+            raise ValueError("Either data or url value is expected for this request, please provide data or a url.")
+
+        loop = IOLoop.current()
+        # if both data and url are provided, prefer data
+        if data:
+            _api = data if isinstance(data, API) else API(data)
+        else:
+            file = await download_async(url)
+            _api = API(await loop.run_in_executor(executor, decoder.to_dict, file.raw), url=url)
+
+        if not _api.is_trapi:
+            return await loop.run_in_executor(executor, self.get_non_TRAPI_metadatas, _api, extra_data)
+
+        metadata_list = await loop.run_in_executor(executor, self.get_TRAPI_with_metakg_endpoint, _api)
+        count_metadata_list = len(metadata_list)
+        self.metakg_errors = {}
+
+        metakg = []
+        for i, metadata in enumerate(metadata_list):
+            if not metadata.get("url"):
+                continue
+            metakg.extend(await self.get_url_metakg_async(
+                metadata, f"[{i + 1}/{count_metadata_list}]", extra_data=extra_data, executor=executor
+            ))
+
+        self._log_metakg_errors()
+        return metakg
+
+    async def get_url_metakg_async(self, metadata, extra_log_msg="", extra_data=None, executor=None) -> List[Dict]:
+        """
+        Return the MetaKG edges of the /meta_knowledge_graph response of the metadata server url.
+        The response is downloaded without blocking the IOLoop and parsed in executor. Requests
+        to the server count against max_requests_per_host, like those of iter_url_edges.
+        Errors are recorded in self.metakg_errors, as with iter_url_edges, and no edges are returned.
+        """
+        url = metadata["url"]
+        logger.info(f'Fetching "{url}" {extra_log_msg}...')
+        try:
+            semaphore = await acquire_host_semaphore(url, self.max_requests_per_host)
+            try:
+                response = await AsyncHTTPClient().fetch(
+                    self.construct_query_url(url),
+                    request_timeout=self.get_url_timeout,
+                    raise_error=False,
+                    ca_certs=certifi.where(),
+                )
+            finally:
+                semaphore.release()
+            if response.code != 200:
+                raise Exception("Not Found")
+            metakg = await IOLoop.current().run_in_executor(
+                executor, self.parse_trapi_metakg_response, response.body, metadata, extra_data
+            )
+        except Exception as err:
+            self._record_url_error(url, err)
+        else:
+            logger.info("Done [%s edges]", len(metakg))
+            return metakg
+        return []
+
+    def parse_trapi_metakg_response(self, body, metadata, extra_data=None):
+        """Return the MetaKG edges of the body of a TRAPI /meta_knowledge_graph response."""
+        response = json.loads(body)
+        if not isinstance(response, dict):
+            raise ValueError("Expected a JSON object.")
+        ops = self.iter_trapi_ops(response.get("edges", []), metadata)
+        return self.extract_metakgedges(ops, extra_data=extra_data)
+
     def get_non_TRAPI_metadatas(self, data: Union[Dict, API], extra_data: Optional[Dict] = None) -> List[Dict]:
         """
         Extract MetaKG edges from a SmartAPI document provided as `data` or fetched from a `url`.
         Raises an error if no valid input is given, or if parser fails to parse the document.
         """
+        return [edge.to_dict() for edge in self.iter_non_TRAPI_metadatas(data, extra_data=extra_data)]
+
+    def iter_non_TRAPI_metadatas(
+        self, data: Union[Dict, API], extra_data: Optional[Dict] = None
+    ) -> Iterator[MetaKGEdge]:
+        """Generator version of get_non_TRAPI_metadatas, yielding MetaKGEdge records."""
         _api = data if isinstance(data, API) else API(data)
-        mkg = self.extract_metakgedges(_api.metadata["operations"], extra_data=extra_data)
-        no_nodes = len({x["subject"] for x in mkg} | {x["object"] for x in mkg})
-        no_edges = len({x["predicate"] for x in mkg})
-        logger.info("Done [%s nodes, %s edges]", no_nodes, no_edges)
-        return mkg
+        nodes, predicates = set(), set()
+        for edge in self.iter_metakgedges(_api.operations, extra_data=extra_data):
+            nodes.update((edge.subject, edge.object))
+            predicates.add(edge.predicate)
+            yield edge
+        logger.info("Done [%s nodes, %s edges]", len(nodes), len(predicates))
 
     def get_TRAPI_metadatas(self, data: Union[Dict, API], extra_data: Optional[Dict] = None) -> List[Dict]:
         """
         Extract and process TRAPI metadata from a SmartAPI document or URL.
         Returns MetaKG edges or propagates errors.
         """
-        ops = []
+        return [edge.to_dict() for edge in self.iter_TRAPI_metadatas(data, extra_data=extra_data)]
+
+    def iter_TRAPI_metadatas(self, data: Union[Dict, API], extra_data: Optional[Dict] = None) -> Iterator[MetaKGEdge]:
+        """
+        Generator version of get_TRAPI_metadatas, yielding MetaKGEdge records. Edges are yielded
+        while the TRAPI metakg responses are downloaded and parsed, no whole response is held in memory.
+        self.metakg_errors is complete once the generator is exhausted.
+        """
         metadata_list = self.get_TRAPI_with_metakg_endpoint(data)
         count_metadata_list = len(metadata_list)
         self.metakg_errors = {}
 
         for i, metadata in enumerate(metadata_list):
-            ops.extend(self.get_ops_from_metakg_endpoint(metadata, f"[{i + 1}/{count_metadata_list}]"))
+            ops = self.iter_ops_from_metakg_endpoint(metadata, f"[{i + 1}/{count_metadata_list}]")
+            yield from self.iter_metakgedges(ops, extra_data=extra_data)
 
+        self._log_metakg_errors()
+
+    def _record_url_error(self, url, err):
+        """Log the error of a TRAPI metakg request to url, and record it in self.metakg_errors."""
+        if isinstance(err, (requests.ReadTimeout, HTTPTimeoutError)):
+            logger.error("Skipped [Timeout]")
+            self.metakg_errors.setdefault("ReadTimeout", []).append(url)
+        elif isinstance(err, ValueError):
+            logger.error("Skipped [Invalid response: %s]", err)
+            self.metakg_errors.setdefault("Invalid response type", []).append(url)
+        else:
+            err = repr(err)
+            logger.error(f"Skipped [{err}]")
+            self.metakg_errors.setdefault(err, []).append(url)
+
+    def _log_metakg_errors(self):
+        """Log the errors recorded in self.metakg_errors, if any."""
         if self.metakg_errors:
             cnt_metakg_errors = sum(len(x) for x in self.metakg_errors.values())
             logger.error(f"Found {cnt_metakg_errors} TRAPI metakg errors:\n {json.dumps(self.metakg_errors, indent=2)}")
 
-        return self.extract_metakgedges(ops, extra_data=extra_data)
-
     def get_TRAPI_with_metakg_endpoint(self, data: Union[Dict, API]):
         """
         Retrieve TRAPI metadata from a SmartAPI document or URL.
@@ -75,7 +223,8 @@ class MetaKGParser:
         metadatas = []
         _api = data if isinstance(data, API) else API(data)
 
-        metadata = _api.metadata
+        # the operations are not needed, only the API metadata
+        metadata = _api.api_meta
         _paths = metadata.get("paths", {})
         _team = metadata.get("x-translator", {}).get("team")
 
@@ -97,119 +246,157 @@ class MetaKGParser:
         return _input
 
     def parse_trapi_metakg_endpoint(self, response, metadata):
-        ops = []
-        for pred in response.get("edges", []):
-            ops.append(
-                {
-                    "association": {
-                        "input_type": self.remove_bio_link_prefix(pred["subject"]),
-                        "output_type": self.remove_bio_link_prefix(pred["object"]),
-                        "predicate": self.remove_bio_link_prefix(pred["predicate"]),
-                        "api_name": metadata.get("title"),
-                        "smartapi": metadata.get("smartapi"),
-                        "x-translator": metadata.get("x-translator"),
-                    },
-                    "tags": [*metadata.get("tags"), "bte-trapi"],
-                    "query_operation": {
-                        "path": "/query",
-                        "method": "post",
-                        "server": metadata.get("url"),
-                        "path_params": None,
-                        "params": None,
-                        "request_body": None,
-                        "support_batch": True,
-                        "input_separator": ",",
-                        "tags": [*metadata.get("tags"), "bte-trapi"],
-                    },
-                }
-            )
-        return ops
+        return list(self.iter_trapi_ops(response.get("edges", []), metadata))
 
-    def get_url(self, url, extra_log_msg=""):
+    def iter_trapi_ops(self, edges, metadata):
+        """Yield the operation of each edge of a TRAPI metakg, edges can be any iterable.
+        The tags list is shared by all the operations, and must not be modified."""
+        tags = [*metadata.get("tags"), "bte-trapi"]
+        for pred in edges:
+            yield {
+                "association": {
+                    "input_type": self.remove_bio_link_prefix(pred["subject"]),
+                    "output_type": self.remove_bio_link_prefix(pred["object"]),
+                    "predicate": self.remove_bio_link_prefix(pred["predicate"]),
+                    "api_name": metadata.get("title"),
+                    "smartapi": metadata.get("smartapi"),
+                    "x-translator": metadata.get("x-translator"),
+                },
+                "tags": tags,
+                "query_operation": {
+                    "path": "/query",
+                    "method": "post",
+                    "server": metadata.get("url"),
+                    "path_params": None,
+                    "params": None,
+                    "request_body": None,
+                    "support_batch": True,
+                    "input_separator": ",",
+                    "tags": tags,
+                },
+            }
+
+    def iter_url_edges(self, url, extra_log_msg="", cache_entry=None):
+        """
+        Yield the edges of the /meta_knowledge_graph response of a TRAPI server url, one at a time,
+        while the response body is downloaded and parsed incrementally.
+
+        With a cache_entry of self.url_cache, the request is conditional. If the payload is not
+        modified (304), nothing is yielded and the generator returns True.
+        Once exhausted, self.url_validators holds the validators of a complete response, i.e. its
+        "etag" and "last_modified", and its content "hash", or None. Errors are recorded in self.metakg_errors,
+        the edges yielded before an error, e.g. a timeout in the middle of the body, are kept.
+        """
         logger.info(f'Fetching "{url}" {extra_log_msg}...')
-        data = {}
-        # sometimes the request is in chunked mode but we can't know beforehand
-        # so we expect chunks first, if that fails fallback to regular get request
+        self.url_validators = None
+        headers = {}
+        if cache_entry:
+            if cache_entry.get("etag"):
+                headers["If-None-Match"] = cache_entry["etag"]
+            if cache_entry.get("last_modified"):
+                headers["If-Modified-Since"] = cache_entry["last_modified"]
+        count = 0
         try:
-            # Using verify=False to bypass SSL: CERTIFICATE_VERIFY_FAILED error on some specific requests
-            #     with requests.get(self.construct_query_url(url), stream=True, verify=True, timeout=self.timeout) as response:
-            #         if response.status_code == 200:
-            #             data_str = ''
-            #             for chunk in (response.raw.read_chunked()):
-            #                 data_str = data_str + chunk.decode("UTF-8")
-            #             data = json.loads(data_str)
-            # except ResponseNotChunked:
-            response = requests.get(
-                self.construct_query_url(url),
-                verify=True,
-                timeout=self.get_url_timeout,
-            )
-            if response.status_code != 200:
-                raise Exception("Not Found")
-            data = response.json()
-        except requests.ReadTimeout:
-            logger.error("Skipped [Timeout]")
-            err = "ReadTimeout"
-            if err in self.metakg_errors:
-                self.metakg_errors[err].append(url)
-            else:
-                self.metakg_errors[err] = [url]
-        except Exception as e:
-            err = repr(e)
-            logger.error(f"Skipped [{err}]")
-            if err in self.metakg_errors:
-                self.metakg_errors[err].append(url)
-            else:
-                self.metakg_errors[err] = [url]
-        if not isinstance(data, dict):
-            logger.error("Skipped [Invalid response type: %s]", type(data))
-            err = "Invalid response type"
-            if err in self.metakg_errors:
-                self.metakg_errors[err].append(url)
-            else:
-                self.metakg_errors[err] = [url]
-            data = {}
-
-        logger.info("Done [%s nodes, %s edges]", len(data.get("nodes", [])), len(data.get("edges", [])))
-        return data
+            with get_host_semaphore(url, self.max_requests_per_host):
+                response = get_session().get(
+                    self.construct_query_url(url),
+                    verify=True,
+                    timeout=self.get_url_timeout,
+                    headers=headers,
+                    stream=True,
+                )
+                try:
+                    if cache_entry and response.status_code == 304:
+                        logger.info("Done [Not modified]")
+                        return True
+                    if response.status_code != 200:
+                        raise Exception("Not Found")
+                    content_hash = hashlib.sha256()
+
+                    def _chunks():
+                        for chunk in response.iter_content(chunk_size=65536):
+                            content_hash.update(chunk)
+                            yield chunk
+
+                    for edge in iter_json_array(_chunks(), "edges"):
+                        count += 1
+                        yield edge
+                    self.url_validators = {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                        "hash": content_hash.hexdigest(),
+                    }
+                finally:
+                    response.close()
+        except Exception as err:
+            self._record_url_error(url, err)
+
+        logger.info("Done [%s edges]", count)
+        return False
 
     def get_ops_from_metakg_endpoint(self, metadata, extra_log_msg=""):
-        if metadata.get("url"):
-            data = self.get_url(metadata["url"], extra_log_msg=extra_log_msg)
-            return self.parse_trapi_metakg_endpoint(data, metadata)
-        return []
+        return list(self.iter_ops_from_metakg_endpoint(metadata, extra_log_msg=extra_log_msg))
+
+    def iter_ops_from_metakg_endpoint(self, metadata, extra_log_msg=""):
+        """
+        Yield the operations of the TRAPI metakg of the metadata server url. They are written
+        to self.url_cache, or to a temporary one, while the response is parsed, and only yielded
+        once the response is complete, so that a response failing midway yields no partial
+        operations. The last complete operations of the url are yielded instead, if cached
+        and if the server reports the metakg as not modified or fails.
+        """
+        if not metadata.get("url"):
+            return
+        if self.url_cache is None:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                yield from self._iter_cached_ops(MetaKGURLCache(tmp_dir), metadata, extra_log_msg)
+            return
+        yield from self._iter_cached_ops(self.url_cache, metadata, extra_log_msg)
+
+    def _iter_cached_ops(self, url_cache, metadata, extra_log_msg=""):
+        url = metadata["url"]
+        # cached operations also hold fields of the metadata,
+        # they are only reused if those fields did not change
+        fingerprint = self.get_metadata_fingerprint(metadata)
+        cache_entry = url_cache.get(url)
+        if cache_entry and cache_entry.get("fingerprint") != fingerprint:
+            cache_entry = None
+        not_modified = False
+
+        def _edges():
+            nonlocal not_modified
+            not_modified = yield from self.iter_url_edges(url, extra_log_msg=extra_log_msg, cache_entry=cache_entry)
+
+        with url_cache.writer(url) as writer:
+            for op in self.iter_trapi_ops(_edges(), metadata):
+                writer.write(op)
+            if self.url_validators:
+                cache_entry = writer.commit({**self.url_validators, "fingerprint": fingerprint})
+            elif not not_modified and cache_entry:
+                logger.warning("Using the cached metakg of %s", url)
+        if cache_entry:
+            yield from url_cache.iter_ops(cache_entry)
+
+    def get_metadata_fingerprint(self, metadata):
+        """Return a hash of the metadata fields copied into the TRAPI operations."""
+        fields = {key: metadata.get(key) for key in ("title", "smartapi", "x-translator", "tags", "url")}
+        return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()
 
     def extract_metakgedges(self, ops, extra_data=None):
+        return [edge.to_dict() for edge in self.iter_metakgedges(ops, extra_data=extra_data)]
+
+    def iter_metakgedges(self, ops, extra_data=None):
+        """
+        Yield the MetaKG edge of each operation, as a MetaKGEdge, ops can be any iterable.
+        The API metadata of the edges is shared between them.
+        """
         extra_data = extra_data or {}
-        metakg_edges = []
+        cache = EdgeAPICache()
         for op in ops:
-            smartapi_data = op["association"]["smartapi"]
+            association = op["association"]
+            smartapi_data = association["smartapi"]
             url = (smartapi_data.get("meta") or {}).get("url") or extra_data.get("url")
             _id = smartapi_data.get("id") or extra_data.get("id")
-            edge = {
-                "subject": op["association"]["input_type"],
-                "object": op["association"]["output_type"],
-                "predicate": op["association"]["predicate"],
-                "api": {
-                    "name": op["association"]["api_name"],
-                    "smartapi": {
-                        "metadata": url,
-                        "id": _id,
-                        "ui": f"https://smart-api.info/ui/{_id}",
-                    },
-                    "tags": op["tags"],
-                    "x-translator": op["association"]["x-translator"],
-                    "provided_by": op["association"].get("source"),
-                    # "date_created": (smartapi_data.get("meta") or {}).get("date_created"),
-                    # "date_updated": (smartapi_data.get("meta") or {}).get("date_updated"),
-                    # "username": (smartapi_data.get("meta") or {}).get("username"),
-                },
-            }
-            # Conditionally add subject_prefix and object_prefix if they exist
-            if "input_id" in op["association"]:
-                edge["subject_prefix"] = op["association"]["input_id"]
-            if "output_id" in op["association"]:
-                edge["object_prefix"] = op["association"]["output_id"]
             # include bte-specific edge metadata
             bte = {}
             for attr in ["query_operation", "response_mapping"]:
@@ -219,7 +406,13 @@ class MetaKGParser:
                 if attr == "query_operation" and "tags" in bte[attr]:
                     bte[attr] = copy(bte[attr])
                     del bte[attr]["tags"]
-            if bte:
-                edge["api"]["bte"] = bte
-            metakg_edges.append(edge)
-        return metakg_edges
+            yield MetaKGEdge(
+                subject=association["input_type"],
+                object=association["output_type"],
+                predicate=association["predicate"],
+                api=cache.get_api(association["api_name"], url, _id, op["tags"], association["x-translator"]),
+                subject_prefix=cache.get_prefixes(association.get("input_id")),
+                object_prefix=cache.get_prefixes(association.get("output_id")),
+                provided_by=association.get("source"),
+                bte=bte,
+            )
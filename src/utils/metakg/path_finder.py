@@ -1,10 +1,12 @@
-import networkx as nx
+import threading
+from collections import OrderedDict
+
+from .bte import BTE_REF, get_bte_refs, get_operations, hydrate_apis
+from .graph import MetaKGGraph
 
-from controller.metakg import MetaKG
-from model import ConsolidatedMetaKGDoc
 
 class MetaKGPathFinder:
-    def __init__(self, query_data=None, expanded_fields=None):
+    def __init__(self, query_data=None, expanded_fields=None, graph=None):
         """
         Initialize the MetaKGPathFinder class.
 
@@ -13,43 +15,30 @@ class MetaKGPathFinder:
             Optional data to filter which documents to use while creating the graph.
         - expanded_fields: dict (default=None)
             Optional fields to expand subjects and objects in the graph.
+        - graph: MetaKGGraph (default=None)
+            Optional prebuilt graph, e.g. the shared one from utils.metakg.graph.graph_store.
+            If not provided, a new graph is built from the index using query_data.
         """
-        self.predicates = {}
         self.expanded_fields = expanded_fields or {"subject": [], "object": []}
-        self.get_graph(query_data=query_data)
+        self.truncated = False
+        self.operations = {}  # BTE operation payloads fetched so far, by bte_ref
+        if graph is None:
+            graph = self.get_graph(query_data=query_data)
+        self.graph = graph
 
     def get_graph(self, query_data=None):
         """
         Construct a directed graph from the indexed documents in the metakg consolidated index.
 
-        This method traverses the index documents, extracts nodes and edges,
-        and uses them to create a directed graph using the networkx library.
-
         Parameters:
         - query_data: dict (default=None)
             Optional data to filter which documents to use for graph construction.
 
         Returns:
-        - G: nx.DiGraph
-            A directed graph constructed from the indexed documents.
+        - graph: MetaKGGraph
+            A compact integer-indexed graph holding the edges and their predicates.
         """
-        index = ConsolidatedMetaKGDoc.Index.name
-        predicates = self.predicates
-        self.G = nx.DiGraph()
-
-        for doc in MetaKG.get_all_via_scan(size=1000, query_data=query_data, index=index):
-            subject = doc["_source"]["subject"]
-            object = doc["_source"]["object"]
-            predicate = doc["_source"]["predicate"]
-            api = [api_dict for api_dict in doc["_source"]["api"]]
-            self.G.add_edge(subject, object)
-
-            key = f"{subject}-{object}"
-            if key not in predicates:
-                predicates[key] = []
-            predicates[key].append({"predicate": predicate, "api": api})  # Store both predicate and API
-
-        return self.G
+        return MetaKGGraph.build(query_data=query_data)
 
     def build_edge_results(self, paths_data, data, api_details, source_node, target_node, bte):
         """
@@ -72,11 +61,14 @@ class MetaKGPathFinder:
         """
 
         apis = data["api"]
+        if bte:
+            apis = [dict(item) for item in apis]
+            hydrate_apis(apis, self.operations)
         if api_details:
-            api_content = apis
+            api_content = [{key: value for key, value in item.items() if key != BTE_REF} for item in apis]
         else:
             if bte:
-                api_content = [{"api": {"name": item.get("name", None), "smartapi": {"id": item["smartapi"]["id"]}}, "bte": item["bte"]} for item in apis]
+                api_content = [{"api": {"name": item.get("name", None), "smartapi": {"id": item["smartapi"]["id"]}}, "bte": item.get("bte")} for item in apis]
             else:
                 api_content = [{"api": {"name": item.get("name", None), "smartapi": {"id": item["smartapi"]["id"]}}} for item in apis]
 
@@ -89,7 +81,86 @@ class MetaKGPathFinder:
 
         return paths_data
 
-    def get_paths(self, cutoff=2, api_details=False, predicate_filter=None, bte=False):
+    def fetch_operations(self, slots):
+        """Fetch the BTE operation payloads referenced by the edges of the slots, in a single request."""
+        bte_refs = set()
+        for slot in slots:
+            for _, api in self.graph.edge_data(slot):
+                bte_refs |= get_bte_refs(api)
+        bte_refs -= self.operations.keys()
+        if bte_refs:
+            self.operations.update(get_operations(bte_refs))
+
+    def find_missing_node(self):
+        """
+        Return an error message if an expanded subject or object is not in the graph, else None.
+        """
+        for subject in self.expanded_fields["subject"]:
+            for object in self.expanded_fields["object"]:
+                if subject not in self.graph:
+                    return f"Subject node {subject} is not found in the MetaKG"
+                if object not in self.graph:
+                    return f"Object node {object} is not found in the MetaKG"
+        return None
+
+    def iter_paths(self, cutoff=2, api_details=False, predicate_filter=None, bte=False, size=None, from_=0, max_paths=None):
+        """
+        Yield the simple paths between expanded subjects and objects in the graph, one at a time.
+
+        Takes the same parameters as get_paths. Each item is a dict with the "path" and its "edges".
+        Paths are generated as they are found, so that the results can be streamed to the client.
+        Call find_missing_node first, subjects and objects not in the graph are skipped here.
+
+        Enumeration stops as soon as from_ + size paths, or max_paths paths, have been found.
+        In that case self.truncated is set to True, as more paths may exist.
+        """
+        self.truncated = False
+        stop = max_paths
+        if size is not None:
+            stop = from_ + size if stop is None else min(stop, from_ + size)
+
+        paths = self._enumerate_paths(cutoff, api_details, predicate_filter, bte)
+        for i, paths_data in enumerate(paths):
+            if stop is not None and i >= stop:
+                self.truncated = True
+                return
+            if i >= from_:
+                yield paths_data
+
+    def _enumerate_paths(self, cutoff, api_details, predicate_filter, bte):
+        predicate_filter_set = set(predicate_filter) if predicate_filter else None
+
+        if 'predicate' in self.expanded_fields and self.expanded_fields['predicate']:
+            predicate_filter_set.update(self.expanded_fields['predicate'])
+
+        graph = self.graph
+        # all subject-object pairs are searched in a single traversal
+        sources = [graph.node_id(subject) for subject in self.expanded_fields["subject"] if subject in graph]
+        targets = [graph.node_id(object) for object in self.expanded_fields["object"] if object in graph]
+        # only the edges with a filtered predicate are followed during traversal
+        predicates = None
+        if predicate_filter_set:
+            predicates = [graph.predicate_ids[p] for p in predicate_filter_set if p in graph.predicate_ids]
+        raw_paths = graph.iter_paths(sources, targets, cutoff, predicates=predicates)
+        for path_ids, path_slots in raw_paths:
+            if bte:
+                self.fetch_operations(path_slots)
+            path = [graph.nodes[node_id] for node_id in path_ids]
+            paths_data = {"path": path, "edges": []}
+            edge_added = False
+            for i, slot in enumerate(path_slots):
+                source_node = path[i]
+                target_node = path[i + 1]
+                for predicate, api in graph.edge_data(slot):
+                    if predicate_filter_set and predicate not in predicate_filter_set:
+                        continue
+                    data = {"predicate": predicate, "api": api}
+                    paths_data = self.build_edge_results(paths_data, data, api_details, source_node, target_node, bte)
+                    edge_added = True
+            if edge_added:
+                yield paths_data
+
+    def get_paths(self, cutoff=2, api_details=False, predicate_filter=None, bte=False, size=None, from_=0, max_paths=None):
         """
         Find all simple paths between expanded subjects and objects in the graph.
 
@@ -100,51 +171,105 @@ class MetaKGPathFinder:
             If True, includes full details of the 'api' in the result.
         - predicate_filter: list (default=None)
             A list of predicates to filter the results by.
+            Only paths whose every edge has one of these predicates are returned.
         - bte: bool (default=False)
             If True, includes BTE information in the result.
+        - size: int (default=None)
+            The maximum number of paths to return, all paths if None.
+        - from_: int (default=0)
+            The number of paths to skip, for pagination.
+        - max_paths: int (default=None)
+            The maximum number of paths to enumerate, whatever size and from_.
+            self.truncated tells if enumeration stopped at size or max_paths.
         Returns:
         - all_paths_with_edges: list of dict
             A list containing paths and their edge information for all subject-object pairs.
         """
+        error = self.find_missing_node()
+        if error:
+            return { "error": error }
+        try:
+            return list(self.iter_paths(cutoff, api_details, predicate_filter, bte, size, from_, max_paths))
+        except Exception as e:
+            return  { "error": e }
 
-        all_paths_with_edges = []
 
-        predicate_filter_set = set(predicate_filter) if predicate_filter else None
+class PathResultCache:
+    """
+    Bounded LRU cache of finished path results, shared by all requests.
 
-        if 'predicate' in self.expanded_fields and self.expanded_fields['predicate']:
-            predicate_filter_set.update(self.expanded_fields['predicate'])
+    Entries are weighted by their number of edges, the least recently used
+    ones are evicted once max_edges is exceeded. The results are only valid
+    for the graph they were computed on: when a different graph is passed,
+    e.g. after the consolidated MetaKG is rebuilt, the cache is cleared.
+    """
 
-        try:
-            # Graph iteration over subject-object pairs
-            for subject in self.expanded_fields["subject"]:
-                for object in self.expanded_fields["object"]:
-                    if subject not in self.G:
-                        return { "error": f"Subject node {subject} is not found in the MetaKG" }
-                    if object not in self.G:
-                        return { "error": f"Object node {object} is not found in the MetaKG" }
-                    try:
-                        # Check if a path exists between the subject and object
-                        if nx.has_path(self.G, subject, object):
-                            raw_paths = nx.all_simple_paths(self.G, source=subject, target=object, cutoff=cutoff)
-                            for path in raw_paths:
-                                paths_data = {"path": path, "edges": []}
-                                edge_added = False
-                                for i in range(len(path) - 1):
-                                    source_node = path[i]
-                                    target_node = path[i + 1]
-                                    edge_key = f"{source_node}-{target_node}"
-                                    edge_data = self.predicates.get(edge_key, [])
-
-                                    for data in edge_data:
-                                        if predicate_filter_set and data["predicate"] not in predicate_filter_set:
-                                            continue
-                                        paths_data = self.build_edge_results(paths_data, data, api_details, source_node, target_node, bte)
-                                        edge_added = True
-                                if edge_added:
-                                    all_paths_with_edges.append(paths_data)
-                    except nx.exception.NodeNotFound as node_err:
-                        return { "error": node_err }
-            return all_paths_with_edges
+    def __init__(self, max_edges=100000):
+        self.max_edges = max_edges
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (result, weight)
+        self._weight = 0
+        self._graph = None
+        self._lock = threading.Lock()
 
-        except Exception as e:
-            return  { "error": e }
+    @staticmethod
+    def make_key(subject, object, cutoff, predicates=None, expand=None, api_details=False, bte=False, **page):
+        """Normalize the query parameters into a cache key, page holds the pagination parameters."""
+        return (
+            subject,
+            object,
+            cutoff,
+            tuple(sorted(set(predicates or ()))),
+            tuple(sorted(set(expand or ()))),
+            bool(api_details),
+            bool(bte),
+            tuple(sorted(page.items())),
+        )
+
+    def _check_graph(self, graph):
+        if graph is not self._graph:
+            self._entries.clear()
+            self._weight = 0
+            self._graph = graph
+
+    def get(self, graph, key):
+        """Return the cached result of key computed on graph, or None."""
+        with self._lock:
+            self._check_graph(graph)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, graph, key, result, weight):
+        """Cache the result of key computed on graph, unless it alone exceeds max_edges."""
+        weight += 1  # count the entry itself, so that empty results also take room
+        if weight > self.max_edges:
+            return
+        with self._lock:
+            self._check_graph(graph)
+            if key in self._entries:
+                self._weight -= self._entries.pop(key)[1]
+            self._entries[key] = (result, weight)
+            self._weight += weight
+            while self._weight > self.max_edges:
+                _, (_, evicted_weight) = self._entries.popitem(last=False)
+                self._weight -= evicted_weight
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._weight = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "edges": self._weight,
+            "max_edges": self.max_edges,
+        }
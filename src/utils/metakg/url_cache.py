@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import uuid
+
+logger = logging.getLogger("metakg_url_cache")
+
+
+class MetaKGURLCache:
+    """
+    On-disk cache of the TRAPI /meta_knowledge_graph responses, one JSON file per url.
+
+    Each entry holds the validators of the last complete response, i.e. its
+    "etag" and "last_modified", and the name of the "ops_file" with the
+    operations parsed from it, one JSON document per line, so that an
+    unchanged payload is neither downloaded nor parsed again, and its
+    operations are read back one at a time. The content "hash" of the
+    response is only used to name the ops file.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, self._key(url) + ".json")
+
+    def get(self, url):
+        """Return the cached entry of url, or None."""
+        try:
+            with open(self._path(url)) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Ignored invalid cache entry of %s: %s", url, e)
+            return None
+        if entry.get("url") != url:
+            return None
+        if entry.get("ops_file") and not os.path.exists(os.path.join(self.cache_dir, entry["ops_file"])):
+            return None
+        return entry
+
+    def iter_ops(self, entry):
+        """Yield the cached operations of an entry returned by get()."""
+        if "ops_file" not in entry:
+            # entries written before the operations were stored apart
+            yield from entry.get("ops", [])
+            return
+        with open(os.path.join(self.cache_dir, entry["ops_file"])) as f:
+            for line in f:
+                yield json.loads(line)
+
+    def writer(self, url):
+        """
+        Return a context manager writing the operations of url to the cache. The entry is
+        only replaced if its commit() is called, otherwise the operations are discarded.
+        """
+        return _MetaKGURLCacheWriter(self, url)
+
+    def set(self, url, entry, ops=()):
+        """Save the entry and operations of url, replacing any previous ones atomically."""
+        with self.writer(url) as writer:
+            for op in ops:
+                writer.write(op)
+            writer.commit(entry)
+
+    def _write_entry(self, url, entry):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({**entry, "url": url}, f)
+            os.replace(tmp_path, self._path(url))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+class _MetaKGURLCacheWriter:
+    def __init__(self, cache, url):
+        self.cache = cache
+        self.url = url
+        self._file = None
+        self._tmp_path = None
+
+    def __enter__(self):
+        os.makedirs(self.cache.cache_dir, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=self.cache.cache_dir, suffix=".tmp")
+        self._file = os.fdopen(fd, "w")
+        return self
+
+    def write(self, op):
+        self._file.write(json.dumps(op))
+        self._file.write("\n")
+
+    def commit(self, entry):
+        """Save the written operations and the entry of the url, and return the saved entry."""
+        self._file.close()
+        previous = self.cache.get(self.url)
+        key = self.cache._key(self.url)
+        # named after the content hash, a reader of the previous entry is never affected
+        ops_file = f"{key}.{(entry.get('hash') or uuid.uuid4().hex)[:16]}.ndjson"
+        os.replace(self._tmp_path, os.path.join(self.cache.cache_dir, ops_file))
+        self._tmp_path = None
+        entry = {**entry, "ops_file": ops_file}
+        self.cache._write_entry(self.url, entry)
+        if previous and previous.get("ops_file") and previous["ops_file"] != ops_file:
+            try:
+                os.remove(os.path.join(self.cache.cache_dir, previous["ops_file"]))
+            except OSError:
+                pass
+        return {**entry, "url": self.url}
+
+    def __exit__(self, *exc_info):
+        if not self._file.closed:
+            self._file.close()
+        if self._tmp_path:
+            os.remove(self._tmp_path)
+            self._tmp_path = None
+        return False
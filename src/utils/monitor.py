@@ -24,12 +24,23 @@ import requests
 # pylint:disable=import-error, ungrouped-imports
 from requests.packages.urllib3.exceptions import InsecureRequestWarning  # pyright: ignore [reportMissingImports]
 
+from utils.http_client import get_session
+
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)  # pylint:disable=no-member
 
 
 logger = logging.getLogger("utils.monitor")
 
 
+def get_monitor_session():
+    """
+    Return the session of the uptime checks. Neither connection errors nor error
+    statuses are retried, so that a flapping API is reported as failing, and a
+    check takes one request.
+    """
+    return get_session("monitor", retries=0)
+
+
 def _shorten(s, width=80):  # pylint: disable=invalid-name
     """a helper function to shorten long string to 80 max-length"""
     return shorten(s, width=width, placeholder="...")
@@ -279,7 +290,7 @@ class Endpoint:
         self.components = endpoint_doc.get("components")
 
     def make_api_call(self):
-        """Use requests package to send the example query to an API endpoint"""
+        """Send the example query to an API endpoint, through the shared HTTP session"""
         headers = {"User-Agent": "SmartAPI API status monitor"}
         url = self.endpoint_name
         # logger = logging.getLogger("utils.uptime.endpoint.make_api_call")
@@ -314,7 +325,7 @@ class Endpoint:
             )
             if params:
                 _request_kwargs["params"] = params
-            response = requests.get(**_request_kwargs)
+            response = get_monitor_session().get(**_request_kwargs)
             logger.debug("[GET]: \n%s\n%s", pformat(_request_kwargs), response)
             return response
 
@@ -405,7 +416,7 @@ class Endpoint:
                     _request_kwargs["json"] = example
                 else:
                     _request_kwargs["data"] = example
-            response = requests.post(**_request_kwargs)
+            response = get_monitor_session().post(**_request_kwargs)
             logger.debug("[POST]: \n%s\n%s", pformat(_request_kwargs), response)
             return response
 